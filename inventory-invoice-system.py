@@ -3,13 +3,207 @@ import re
 import datetime
 import csv
 import hashlib
+import secrets
 import os
-from typing import List, Dict, Optional, Tuple
-from dataclasses import dataclass, asdict
+import sys
+import math
+import time
+import sqlite3
+import argparse
+import bisect
+import gc
+import tracemalloc
+import operator
+import gzip
+import itertools
+import functools
+import atexit
+import inspect
+import threading
+import heapq
+import contextlib
+import random
+import tempfile
+import platform
+import shutil
+from types import MappingProxyType
+import concurrent.futures
+import asyncio
+import statistics
+import traceback
+from collections import deque
+from http import HTTPStatus
+from urllib.parse import urlsplit, parse_qs
+from concurrent.futures.process import BrokenProcessPool
+from array import array
+from typing import List, Dict, Optional, Tuple, Iterator, Iterable, Callable
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from dataclasses import dataclass, asdict, field, fields
 from enum import Enum
 from fpdf import FPDF
 from abc import ABC, abstractmethod
 
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Metrics
+class Metrics:
+    # Counters, gauges and timing histograms rendered in the Prometheus text
+    # format. Collection is off until enabled is set; instrumented code
+    # checks the flag first, so a disabled registry costs one attribute read.
+    buckets = (0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 60.0)
+
+    def __init__(self, prefix: str = 'inventory', enabled: bool = False):
+        self.prefix = prefix
+        self.enabled = enabled
+        self._counters: Dict[Tuple[str, tuple], float] = {}
+        self._gauges: Dict[Tuple[str, tuple], float] = {}
+        self._timers: Dict[Tuple[str, tuple], list] = {}  # -> [bucket counts..., count, sum]
+        self._help: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def describe(self, name: str, help: str):
+        self._help[name] = help
+
+    def inc(self, name: str, amount: float = 1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def set_gauge(self, name: str, value: float, **labels):
+        self._gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def observe(self, name: str, seconds: float, **labels):
+        self._observe((name, tuple(sorted(labels.items()))), seconds)
+
+    def _observe(self, key: Tuple[str, tuple], seconds: float):
+        with self._lock:
+            timer = self._timers.get(key)
+            if timer is None:
+                timer = self._timers[key] = [0] * len(self.buckets) + [0, 0.0]
+            position = bisect.bisect_left(self.buckets, seconds)
+            if position < len(self.buckets):
+                timer[position] += 1
+            timer[-2] += 1
+            timer[-1] += seconds
+
+    @contextlib.contextmanager
+    def timer(self, name: str, **labels):
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._gauges.clear()
+            self._timers.clear()
+
+    @staticmethod
+    def _labels(labels: tuple) -> str:
+        if not labels:
+            return ''
+        return '{' + ','.join(f'{key}="{_escape_label(value)}"' for key, value in labels) + '}'
+
+    def render(self) -> str:
+        with self._lock:
+            counters = sorted(self._counters.items())
+            gauges = sorted(self._gauges.items())
+            timers = sorted((key, list(timer)) for key, timer in self._timers.items())
+        lines = []
+        described = set()
+
+        def header(name: str, kind: str):
+            full_name = f"{self.prefix}_{name}"
+            if full_name not in described:
+                described.add(full_name)
+                if name in self._help:
+                    lines.append(f"# HELP {full_name} {self._help[name]}")
+                lines.append(f"# TYPE {full_name} {kind}")
+            return full_name
+
+        for kind, samples in (('counter', counters), ('gauge', gauges)):
+            for (name, labels), value in samples:
+                full_name = header(name, kind)
+                lines.append(f"{full_name}{self._labels(labels)} {value!r}")
+        for (name, labels), timer in timers:
+            full_name = header(name, 'histogram')
+            cumulative = 0
+            for bound, count in zip(self.buckets, timer):
+                cumulative += count
+                lines.append(f"{full_name}_bucket{self._labels(labels + (('le', bound),))} "
+                             f"{cumulative}")
+            lines.append(f"{full_name}_bucket{self._labels(labels + (('le', '+Inf'),))} "
+                         f"{timer[-2]}")
+            lines.append(f"{full_name}_sum{self._labels(labels)} {timer[-1]!r}")
+            lines.append(f"{full_name}_count{self._labels(labels)} {timer[-2]}")
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path: str):
+        # Atomic, for the node_exporter textfile collector and similar
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(self.render())
+        os.replace(tmp_path, path)
+
+def _escape_label(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+METRICS = Metrics()
+METRICS.describe('operation_seconds', "Time spent in InventorySystem operations")
+METRICS.describe('operation_errors_total', "InventorySystem operations that raised")
+
+def instrumented(operation: str, **labels):
+    # Times each call into operation_seconds{operation=...}; generator
+    # functions are timed until exhausted or closed
+    key = ('operation_seconds', tuple(sorted({'operation': operation, **labels}.items())))
+    error_labels = {'operation': operation, **labels}
+    metrics = METRICS
+
+    def decorate(func):
+        if inspect.isgeneratorfunction(func):
+            @functools.wraps(func)
+            def generator_wrapper(*args, **kwargs):
+                if not metrics.enabled:
+                    return (yield from func(*args, **kwargs))
+                start = time.perf_counter()
+                try:
+                    return (yield from func(*args, **kwargs))
+                except Exception:
+                    metrics.inc('operation_errors_total', **error_labels)
+                    raise
+                finally:
+                    metrics._observe(key, time.perf_counter() - start)
+            return generator_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not metrics.enabled:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            except Exception:
+                metrics.inc('operation_errors_total', **error_labels)
+                raise
+            finally:
+                metrics._observe(key, time.perf_counter() - start)
+        return wrapper
+    return decorate
+
 # Authentication and Authorization
 class User:
     def __init__(self, username: str, password: str, role: str):
@@ -24,19 +218,119 @@ class User:
     def verify_password(self, password: str) -> bool:
         return self._hash_password(password) == self.password_hash
 
+    @classmethod
+    def from_hash(cls, username: str, password_hash: str, role: str) -> 'User':
+        user = cls.__new__(cls)
+        user.username = username
+        user.password_hash = password_hash
+        user.role = role
+        return user
+
+    @property
+    def role(self) -> str:
+        return self._role
+
+    @role.setter
+    def role(self, role: str):
+        # The compiled permission set is resolved once per role assignment,
+        # so a permission check is a single membership test
+        self._role = role
+        self.permissions = Role.get_permissions(role)
+
+class _AllPermissions(frozenset):
+    # Permission set of roles granted "all": contains every permission
+    def __contains__(self, permission) -> bool:
+        return True
+
 class Role:
     ADMIN = "admin"
     MANAGER = "manager"
     STAFF = "staff"
 
     @staticmethod
-    def get_permissions(role: str) -> set:
-        permissions = {
-            Role.ADMIN: {"all"},
-            Role.MANAGER: {"read", "write", "create_invoice", "view_reports"},
-            Role.STAFF: {"read", "create_invoice"}
-        }
-        return permissions.get(role, set())
+    def get_permissions(role: str) -> frozenset:
+        return _ROLE_PERMISSIONS.get(role, _NO_PERMISSIONS)
+
+# Compiled once at import; shared, immutable
+_NO_PERMISSIONS = frozenset()
+_ROLE_PERMISSIONS = {
+    Role.ADMIN: _AllPermissions({"all"}),
+    Role.MANAGER: frozenset({"read", "write", "create_invoice", "view_reports"}),
+    Role.STAFF: frozenset({"read", "create_invoice"})
+}
+
+class SessionManager:
+    # Opaque tokens issued after one successful password check, so clients
+    # making many requests are not re-hashed each time. Validation is a
+    # dict lookup. Sessions expire ttl seconds after login; the table holds
+    # at most max_sessions, evicting the oldest. All sessions share one ttl,
+    # so creation order is also expiry order and expired sessions are
+    # purged from the front.
+    def __init__(self, ttl: float = 3600.0, max_sessions: int = 10000):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self._sessions: OrderedDict = OrderedDict()  # token -> (username, expires)
+        self._tokens_by_user: Dict[str, set] = {}
+        self._lock = threading.Lock()
+
+    def create(self, username: str) -> str:
+        token = secrets.token_urlsafe(32)
+        with self._lock:
+            self._purge_expired()
+            self._sessions[token] = (username, time.monotonic() + self.ttl)
+            self._tokens_by_user.setdefault(username, set()).add(token)
+            while len(self._sessions) > self.max_sessions:
+                self._remove(next(iter(self._sessions)))
+        return token
+
+    def get_username(self, token: str) -> Optional[str]:
+        session = self._sessions.get(token)
+        if session is None:
+            return None
+        username, expires = session
+        if expires < time.monotonic():
+            with self._lock:
+                if token in self._sessions:
+                    self._remove(token)
+            return None
+        return username
+
+    def revoke(self, token: str) -> bool:
+        with self._lock:
+            if token not in self._sessions:
+                return False
+            self._remove(token)
+            return True
+
+    def revoke_user(self, username: str) -> int:
+        with self._lock:
+            tokens = list(self._tokens_by_user.get(username, ()))
+            for token in tokens:
+                self._remove(token)
+            return len(tokens)
+
+    def purge_expired(self):
+        with self._lock:
+            self._purge_expired()
+
+    def _purge_expired(self):
+        now = time.monotonic()
+        while self._sessions:
+            token, (_, expires) = next(iter(self._sessions.items()))
+            if expires >= now:
+                break
+            self._remove(token)
+
+    def _remove(self, token: str):
+        username, _ = self._sessions.pop(token)
+        tokens = self._tokens_by_user.get(username)
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                del self._tokens_by_user[username]
+
+    def __len__(self) -> int:
+        return len(self._sessions)
 
 # Pricing and Discount Rules
 class DiscountRule(ABC):
@@ -61,20 +355,152 @@ class BulkDiscount(DiscountRule):
             return subtotal * (1 - self.percentage / 100)
         return subtotal
 
+# Compiled pricing: a product's rule list is turned once into a tier table
+# (bulk thresholds -> ordered discount factors), so quoting is a bisect
+# plus a few multiplications. Factors are applied in rule order exactly as
+# the rules themselves would, so prices are bit-for-bit identical. Rules
+# are treated as immutable once attached; mutating the product's rule list
+# (or assigning a new one) recompiles on the next quote. Tables for the
+# built-in rules are interned by rule parameters, so products with the same
+# rule set share one table and can be priced together.
+class _PricingTable:
+    __slots__ = ('thresholds', 'tiers', 'steps', 'price', '_matrix')
+
+    def __init__(self, thresholds: tuple = (), tiers: tuple = ((),), steps: Optional[tuple] = None):
+        self.thresholds = thresholds
+        # tiers[i] applies when exactly i thresholds are <= quantity
+        self.tiers = tiers
+        # (apply, takes_quantity) per rule when custom rule types are involved
+        self.steps = steps
+        self._matrix = None
+        if steps is not None:
+            self.price = self._price_custom
+        elif thresholds:
+            self.price = self._price_tiered
+        else:
+            self.price = self._price_flat
+
+    def _price_flat(self, unit_price: float, quantity: int) -> float:
+        price = unit_price * quantity
+        for factor in self.tiers[0]:
+            price *= factor
+        return price
+
+    def _price_tiered(self, unit_price: float, quantity: int) -> float:
+        price = unit_price * quantity
+        for factor in self.tiers[bisect.bisect_right(self.thresholds, quantity)]:
+            price *= factor
+        return price
+
+    def _price_custom(self, unit_price: float, quantity: int) -> float:
+        return self._discount_custom(unit_price * quantity, quantity)
+
+    def discount_many(self, subtotals, quantities):
+        # Vectorized form of price() over NumPy arrays of subtotals
+        # (unit_price * quantity) and quantities, for one rule set
+        if self.steps is not None:
+            return np.array([self._discount_custom(subtotal, quantity)
+                             for subtotal, quantity in zip(subtotals.tolist(), quantities.tolist())],
+                            dtype=np.float64)
+        if self._matrix is None:
+            # Tiers padded with 1.0 (an exact no-op) to a rectangular matrix
+            width = max(len(tier) for tier in self.tiers)
+            self._matrix = np.array([tier + (1.0,) * (width - len(tier)) for tier in self.tiers],
+                                    dtype=np.float64).reshape(len(self.tiers), width)
+        tier_rows = self._matrix[np.searchsorted(self.thresholds, quantities, side='right')]
+        prices = subtotals.copy()
+        for column in range(self._matrix.shape[1]):
+            prices *= tier_rows[:, column]
+        return prices
+
+    def _discount_custom(self, price: float, quantity: int) -> float:
+        for apply, takes_quantity in self.steps:
+            price = apply(price, quantity) if takes_quantity else apply(price)
+        return price
+
+_NO_DISCOUNT = _PricingTable()
+_PRICING_TABLES: Dict[tuple, _PricingTable] = {}
+
+def _compile_pricing(rules: Optional[List[DiscountRule]]) -> _PricingTable:
+    if not rules:
+        return _NO_DISCOUNT
+
+    if any(type(rule) not in (PercentageDiscount, BulkDiscount) for rule in rules):
+        # Custom rule types: keep their apply(), but resolve dispatch once
+        return _PricingTable(steps=tuple((rule.apply, isinstance(rule, BulkDiscount))
+                                         for rule in rules))
+
+    key = tuple((rule.threshold, rule.percentage) if type(rule) is BulkDiscount
+                else (None, rule.percentage) for rule in rules)
+    table = _PRICING_TABLES.get(key)
+    if table is None:
+        thresholds = sorted({threshold for threshold, _ in key if threshold is not None})
+        tiers = tuple(
+            tuple(1 - percentage / 100 for threshold, percentage in key
+                  if threshold is None or threshold <= floor)
+            for floor in [float('-inf')] + thresholds
+        )
+        if len(_PRICING_TABLES) >= 10000:
+            _PRICING_TABLES.clear()
+        table = _PRICING_TABLES[key] = _PricingTable(tuple(thresholds), tiers)
+    return table
+
+class _DiscountRuleList(list):
+    # A product's rule list; any in-place change invalidates its compiled pricing
+    __slots__ = ('_owner',)
+
+    def __init__(self, rules=(), owner: Optional['Product'] = None):
+        super().__init__(rules)
+        self._owner = owner
+
+def _invalidating(name: str):
+    method = getattr(list, name)
+
+    def wrapper(self, *args, **kwargs):
+        result = method(self, *args, **kwargs)
+        if self._owner is not None:
+            self._owner._rules_changed()
+        return result
+    wrapper.__name__ = name
+    return wrapper
+
+for _name in ('append', 'extend', 'insert', 'remove', 'pop', 'clear', 'sort', 'reverse',
+              '__setitem__', '__delitem__', '__iadd__', '__imul__'):
+    setattr(_DiscountRuleList, _name, _invalidating(_name))
+
 # Export Capabilities
 class DataExporter:
     @staticmethod
-    def to_csv(data: List[dict], filename: str):
-        if not data:
-            return
-        
-        with open(filename, 'w', newline='') as f:
-            writer = csv.DictWriter(f, fieldnames=data[0].keys())
+    def to_csv(data: Iterable[dict], filename: str, fieldnames: Optional[List[str]] = None,
+               compress: Optional[bool] = None, chunk_size: int = 1000):
+        # Rows are pulled from any iterable in chunks, so memory stays
+        # constant regardless of row count. Without fieldnames the header
+        # comes from the first row. compress defaults to a '.gz' filename.
+        rows = iter(data)
+        if fieldnames is None:
+            first = next(rows, None)
+            if first is None:
+                return
+            fieldnames = list(first.keys())
+            rows = itertools.chain((first,), rows)
+        if compress is None:
+            compress = filename.endswith('.gz')
+
+        if compress:
+            f = gzip.open(filename, 'wt', newline='')
+        else:
+            f = open(filename, 'w', newline='', buffering=1 << 16)
+        with f:
+            writer = csv.DictWriter(f, fieldnames=fieldnames)
             writer.writeheader()
-            writer.writerows(data)
+            while True:
+                chunk = list(itertools.islice(rows, chunk_size))
+                if not chunk:
+                    break
+                writer.writerows(chunk)
 
     @staticmethod
-    def to_pdf(title: str, content: str, filename: str):
+    def to_pdf(title: str, content, filename: str):
         pdf = FPDF()
         pdf.add_page()
         pdf.set_font("Arial", size=12)
@@ -83,131 +509,3403 @@ class DataExporter:
         pdf.set_font("Arial", 'B', 16)
         pdf.cell(200, 10, txt=title, ln=1, align='C')
         
-        # Add content
+        # Add content (a string, or an iterable of lines from a report)
         pdf.set_font("Arial", size=12)
-        pdf.multi_cell(0, 10, txt=content)
+        if isinstance(content, str):
+            pdf.multi_cell(0, 10, txt=content)
+        else:
+            for line in content:
+                pdf.multi_cell(0, 10, txt=line.rstrip("\n"))
         pdf.output(filename)
 
-# Enhance existing classes with new features
+    @staticmethod
+    def to_pdf_batch(documents: Iterable[Tuple[str, str, str]], output_dir: str,
+                     workers: Optional[int] = None, max_tasks_per_child: int = 100,
+                     progress: Optional[Callable[[int, str, Optional[str]], None]] = None
+                     ) -> Tuple[List[str], Dict[str, str]]:
+        # Renders (title, content, filename) documents into output_dir across
+        # a process pool. Documents are pulled lazily with at most two per
+        # worker in flight, and workers are recycled after max_tasks_per_child
+        # documents, so memory stays bounded. content may be a callable that
+        # returns the text, so it is formatted only when the document is
+        # submitted. A document that fails to format or render is reported
+        # in the returned failures and never stops the batch. If a worker
+        # dies, every document that was in flight is re-run by itself on a
+        # fresh pool, and only one that kills its worker again is failed.
+        os.makedirs(output_dir, exist_ok=True)
+        workers = workers or os.cpu_count() or 1
+        written: List[str] = []
+        failures: Dict[str, str] = {}
+        jobs = ((title, content, os.path.join(output_dir, filename))
+                for title, content, filename in documents)
+
+        def finished(path: str, error: Optional[str]):
+            if error is None:
+                written.append(path)
+            else:
+                failures[path] = error
+            if progress is not None:
+                progress(len(written) + len(failures), path, error)
+
+        def new_pool() -> concurrent.futures.ProcessPoolExecutor:
+            return concurrent.futures.ProcessPoolExecutor(
+                workers, max_tasks_per_child=max_tasks_per_child)
+
+        def collect(futures) -> list:
+            # Records finished futures, returns the jobs lost to a dead worker
+            lost = []
+            for future in futures:
+                job = pending.pop(future)
+                try:
+                    finished(*future.result())
+                except (BrokenProcessPool, concurrent.futures.CancelledError):
+                    lost.append(job)
+            return lost
+
+        def retry_alone(lost: list):
+            nonlocal executor
+            executor.shutdown(cancel_futures=True)
+            executor = new_pool()
+            for job in lost:
+                try:
+                    finished(*executor.submit(_render_pdf_job, job).result())
+                except BrokenProcessPool as e:
+                    finished(job[2], f"worker process died: {e}")
+                    executor.shutdown(cancel_futures=True)
+                    executor = new_pool()
+
+        pending = {}
+        executor = new_pool()
+        try:
+            for job in itertools.chain(jobs, [None]):
+                while pending and (job is None or len(pending) >= workers * 2):
+                    done, _ = concurrent.futures.wait(
+                        pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                    lost = collect(done)
+                    if lost:
+                        # The rest of the broken pool's futures fail with it
+                        concurrent.futures.wait(pending)
+                        retry_alone(lost + collect(list(pending)))
+                if job is None:
+                    break
+                title, content, path = job
+                if callable(content):
+                    try:
+                        job = (title, content(), path)
+                    except Exception as e:
+                        finished(path, f"{type(e).__name__}: {e}")
+                        continue
+                try:
+                    pending[executor.submit(_render_pdf_job, job)] = job
+                except BrokenProcessPool:
+                    concurrent.futures.wait(pending)
+                    retry_alone(collect(list(pending)) + [job])
+        finally:
+            executor.shutdown(cancel_futures=True)
+        return written, failures
+
+def _render_pdf_job(job: Tuple[str, str, str]) -> Tuple[str, Optional[str]]:
+    title, content, path = job
+    try:
+        DataExporter.to_pdf(title, content, path)
+    except Exception as e:
+        return path, f"{type(e).__name__}: {e}"
+    return path, None
+
+# Core models: categories, invoice states and customers
+class ProductCategory(Enum):
+    ELECTRONICS = "electronics"
+    CLOTHING = "clothing"
+    FOOD = "food"
+    BOOKS = "books"
+    OTHER = "other"
+
+class InvoiceStatus(Enum):
+    DRAFT = "draft"
+    PENDING = "pending"
+    PAID = "paid"
+    CANCELLED = "cancelled"
+    REFUNDED = "refunded"
+
 @dataclass
-class Product:
+class Customer:
     id: str
     name: str
-    price: float
+    email: str
+    phone: str
+    address: str
+
+# Enhance existing classes with new features
+# Products, invoice items and invoices exist in very large numbers, so they
+# use __slots__ instead of a per-instance __dict__
+_OBSERVED_PRODUCT_FIELDS = frozenset(('price', 'quantity', 'reorder_level', 'category'))
+
+class Product:
+    __slots__ = ('id', 'name', 'price', 'quantity', 'category', 'reorder_level',
+                 '_discount_rules', '_observer', '_pricer')
+
+    def __init__(self, id: str, name: str, price: float, quantity: int,
+                 category: 'ProductCategory', reorder_level: int = 10,
+                 discount_rules: Optional[List[DiscountRule]] = None):
+        # Called as observer(product, field) after an observed field changes;
+        # set by the InventorySystem that owns the product
+        self._observer = None
+        self._pricer = None
+        self.id = id
+        self.name = name
+        self.price = price
+        self.quantity = quantity
+        self.category = category
+        self.reorder_level = reorder_level
+        # None until a rule is added; most products have no rules
+        self.discount_rules = discount_rules
+
+    def __setattr__(self, name, value):
+        object.__setattr__(self, name, value)
+        observer = self._observer
+        if observer is not None and name in _OBSERVED_PRODUCT_FIELDS:
+            observer(self, name)
+
+    @property
+    def discount_rules(self) -> List[DiscountRule]:
+        if self._discount_rules is None:
+            object.__setattr__(self, '_discount_rules', _DiscountRuleList(owner=self))
+        return self._discount_rules
+
+    @discount_rules.setter
+    def discount_rules(self, rules: Optional[List[DiscountRule]]):
+        if rules is not None:
+            rules = _DiscountRuleList(rules, owner=self)
+        object.__setattr__(self, '_discount_rules', rules)
+        self._rules_changed()
+
+    def _rules_changed(self):
+        object.__setattr__(self, '_pricer', None)
+        if self._observer is not None:
+            self._observer(self, 'discount_rules')
+
+    def _fields(self) -> tuple:
+        return (self.id, self.name, self.price, self.quantity, self.category,
+                self.reorder_level, self._discount_rules or [])
+
+    def __eq__(self, other):
+        if other.__class__ is not self.__class__:
+            return NotImplemented
+        return self._fields() == other._fields()
+
+    __hash__ = None
+
+    def __reduce__(self):
+        # Observer and compiled pricer belong to this process only
+        rules = list(self._discount_rules) if self._discount_rules is not None else None
+        return (self.__class__, (self.id, self.name, self.price, self.quantity,
+                                 self.category, self.reorder_level, rules))
+
+    def __repr__(self) -> str:
+        return (f"Product(id={self.id!r}, name={self.name!r}, price={self.price!r}, "
+                f"quantity={self.quantity!r}, category={self.category!r}, "
+                f"reorder_level={self.reorder_level!r}, "
+                f"discount_rules={self._discount_rules or []!r})")
+
+    def _pricing_table(self) -> _PricingTable:
+        table = self._pricer
+        if table is None:
+            table = _compile_pricing(self._discount_rules)
+            object.__setattr__(self, '_pricer', table)
+        return table
+
+    def get_price(self, quantity: int = 1) -> float:
+        table = self._pricer
+        if table is None:
+            table = self._pricing_table()
+        return table.price(self.price, quantity)
+
+@dataclass(slots=True)
+class InvoiceItem:
+    product_id: str
     quantity: int
-    category: 'ProductCategory'
-    reorder_level: int = 10
-    discount_rules: List[DiscountRule] = None
+    unit_price: float
+    total: float = None
 
     def __post_init__(self):
-        if self.discount_rules is None:
-            self.discount_rules = []
+        if self.total is None:
+            self.total = self.unit_price * self.quantity
 
-    def get_price(self, quantity: int = 1) -> float:
-        price = self.price * quantity
-        for rule in self.discount_rules:
-            if isinstance(rule, BulkDiscount):
-                price = rule.apply(price, quantity)
+@dataclass(slots=True)
+class Invoice:
+    id: str
+    customer_id: str
+    date: str
+    status: 'InvoiceStatus'
+    items: List[InvoiceItem] = field(default_factory=list)
+    tax_rate: float = 0.0
+
+    @property
+    def subtotal(self) -> float:
+        return sum(item.total for item in self.items)
+
+    @property
+    def total(self) -> float:
+        return self.subtotal * (1 + self.tax_rate)
+
+_INVOICE_MUTABLE_FIELDS = frozenset(f.name for f in fields(Invoice)) - {'id'}
+
+# Persistence
+_DISCOUNT_RULE_TYPES = {
+    'PercentageDiscount': PercentageDiscount,
+    'BulkDiscount': BulkDiscount
+}
+
+def _rule_to_record(rule: DiscountRule) -> dict:
+    return {'type': type(rule).__name__, **vars(rule)}
+
+def _rule_from_record(record: dict) -> DiscountRule:
+    params = dict(record)
+    return _DISCOUNT_RULE_TYPES[params.pop('type')](**params)
+
+def _product_to_record(product: Product) -> dict:
+    return {
+        'id': product.id,
+        'name': product.name,
+        'price': product.price,
+        'quantity': product.quantity,
+        'category': product.category.value,
+        'reorder_level': product.reorder_level,
+        'discount_rules': [_rule_to_record(rule) for rule in product._discount_rules or ()]
+    }
+
+def _product_from_record(record: dict) -> Product:
+    return Product(
+        id=record['id'],
+        name=record['name'],
+        price=record['price'],
+        quantity=record['quantity'],
+        category=ProductCategory(record['category']),
+        reorder_level=record.get('reorder_level', 10),
+        discount_rules=[_rule_from_record(r) for r in record.get('discount_rules', [])] or None
+    )
+
+def _customer_to_record(customer: 'Customer') -> dict:
+    return asdict(customer)
+
+def _customer_from_record(record: dict) -> 'Customer':
+    return Customer(**record)
+
+def _invoice_to_record(invoice: 'Invoice') -> dict:
+    record = asdict(invoice)
+    record['status'] = invoice.status.value
+    # Derived, stored so backends can aggregate without rebuilding invoices
+    record['total'] = invoice.total
+    return record
+
+def _invoice_from_record(record: dict) -> 'Invoice':
+    init_fields = {f.name for f in fields(Invoice) if f.init}
+    record = {k: v for k, v in record.items() if k in init_fields}
+    record['items'] = [InvoiceItem(**item) for item in record.get('items', [])]
+    record['status'] = InvoiceStatus(record['status'])
+    return Invoice(**record)
+
+def _user_to_record(user: User) -> dict:
+    return {'username': user.username, 'password_hash': user.password_hash, 'role': user.role}
+
+def _user_from_record(record: dict) -> User:
+    return User.from_hash(record['username'], record['password_hash'], record['role'])
+
+def _date_key(value) -> str:
+    # Invoice dates may be date/datetime objects or ISO strings; compare on YYYY-MM-DD
+    return str(value)[:10]
+
+def _period_bucket(date: str, period: str) -> str:
+    if period == 'month':
+        return date[:7]
+    return f"{date[:4]}-Q{(int(date[5:7]) - 1) // 3 + 1}"
+
+# collection name -> (to_record, from_record)
+_COLLECTIONS = {
+    'products': (_product_to_record, _product_from_record),
+    'customers': (_customer_to_record, _customer_from_record),
+    'invoices': (_invoice_to_record, _invoice_from_record),
+    'users': (_user_to_record, _user_from_record)
+}
+
+def _write_json_atomic(path: str, state: dict):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        # dumps uses the C encoder; dump to a file falls back to pure Python
+        f.write(json.dumps(state, default=str))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+class _JsonStream:
+    # Minimal pull parser over a JSON file of the form {"section": {key:
+    # record, ...}, ...} using only the stdlib: the file is read in chunks
+    # and each key and record is decoded on its own with raw_decode, so
+    # memory holds one chunk plus the record being decoded.
+    chunk_size = 1 << 20
+    _decoder = json.JSONDecoder()
+    _whitespace = re.compile(r'[ \t\n\r]*')
+
+    def __init__(self, f):
+        self._file = f
+        self._buffer = ''
+        self._pos = 0
+        self._eof = False
+
+    def _fill(self) -> bool:
+        if self._eof:
+            return False
+        chunk = self._file.read(self.chunk_size)
+        self._buffer = self._buffer[self._pos:] + chunk
+        self._pos = 0
+        self._eof = not chunk
+        return bool(chunk)
+
+    def _skip_whitespace(self):
+        while True:
+            self._pos = self._whitespace.match(self._buffer, self._pos).end()
+            if self._pos < len(self._buffer) or not self._fill():
+                return
+
+    def peek(self) -> str:
+        self._skip_whitespace()
+        if self._pos >= len(self._buffer):
+            raise ValueError("Unexpected end of JSON data")
+        return self._buffer[self._pos]
+
+    def expect(self, char: str):
+        if self.peek() != char:
+            raise ValueError(f"Expected {char!r} at offset {self._pos} of the JSON chunk")
+        self._pos += 1
+
+    def value(self):
+        self._skip_whitespace()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, self._pos)
+            except json.JSONDecodeError:
+                if not self._fill():
+                    raise
+                continue
+            # A number at the very end of the buffer may continue in the
+            # next chunk; anything else is already complete
+            if end < len(self._buffer) or not self._fill():
+                self._pos = end
+                return value
+
+    def keys(self) -> Iterator[object]:
+        # Walks the object starting at the current position, stopping after
+        # each key; the caller must consume that key's value before the next
+        self.expect('{')
+        if self.peek() == '}':
+            self._pos += 1
+            return
+        while True:
+            key = self.value()
+            self.expect(':')
+            yield key
+            separator = self.peek()
+            self.expect(separator if separator in ',}' else ',')
+            if separator == '}':
+                return
+
+    def items(self) -> Iterator[Tuple[object, object]]:
+        for key in self.keys():
+            yield key, self.value()
+
+def _iter_json_collection(path: str, collection: str) -> Iterator[Tuple[str, dict]]:
+    # Only the requested section is built into Python objects: with ijson
+    # the file is parsed incrementally, otherwise _JsonStream decodes it
+    # record by record. Sections before it are decoded and dropped a record
+    # at a time, and reading stops at its end.
+    if not os.path.exists(path):
+        return
+    if ijson is not None:
+        with open(path, 'rb') as f:
+            yield from ijson.kvitems(f, collection, use_float=True)
+        return
+    with open(path, encoding='utf-8') as f:
+        stream = _JsonStream(f)
+        for name in stream.keys():
+            if name == collection:
+                yield from stream.items()
+                return
+            for _ in stream.items():
+                pass
+
+class StorageBackend(ABC):
+    # Backends that can persist a single record change cheaply set this, so
+    # the system calls put/delete instead of rewriting the full state.
+    incremental = False
+
+    @abstractmethod
+    def load(self) -> Dict[str, Dict[str, dict]]:
+        pass
+
+    @abstractmethod
+    def save(self, state: Dict[str, Dict[str, dict]]):
+        pass
+
+    # Stream one collection's records; backends override this to avoid
+    # materializing the whole state
+    def load_collection(self, collection: str) -> Iterator[Tuple[str, dict]]:
+        yield from self.load().get(collection, {}).items()
+
+    # Single-record lookup for backends with random access, None otherwise
+    def load_record(self, collection: str, key: str) -> Optional[dict]:
+        return None
+
+    random_access = False
+
+    def put(self, collection: str, key: str, record: dict):
+        pass
+
+    # Batch of puts; backends override this to write the batch at once
+    def put_many(self, collection: str, records: Iterable[Tuple[str, dict]]):
+        for key, record in records:
+            self.put(collection, key, record)
+
+    # Puts across collections that must land together or not at all;
+    # incremental backends override this to make the batch atomic
+    def put_batch(self, batch: Dict[str, List[Tuple[str, dict]]]):
+        for collection, records in batch.items():
+            self.put_many(collection, records)
+
+    def delete(self, collection: str, key: str):
+        pass
+
+    def needs_compaction(self) -> bool:
+        return False
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.flush()
+
+class JsonFileStorage(StorageBackend):
+    # Whole-file JSON: every change rewrites the full data file
+    def __init__(self, path: str):
+        self.path = path
+
+    def load(self) -> Dict[str, Dict[str, dict]]:
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path) as f:
+            return json.load(f)
+
+    def load_collection(self, collection: str) -> Iterator[Tuple[str, dict]]:
+        return _iter_json_collection(self.path, collection)
+
+    def save(self, state: Dict[str, Dict[str, dict]]):
+        _write_json_atomic(self.path, state)
+
+class JournalStorage(StorageBackend):
+    # Snapshot file (same format as JsonFileStorage) plus an append-only
+    # journal of put/delete entries replayed on load. Every entry is written
+    # to the file as it happens, so exiting without close() loses nothing;
+    # only the fsync is batched (every sync_every entries or sync_interval
+    # seconds), so an OS crash can lose at most the last unsynced batch. Once the journal
+    # holds compact_every entries the system writes a fresh snapshot and the
+    # journal is truncated. Replaying is idempotent, so a crash between the
+    # snapshot rename and the truncate is harmless.
+    incremental = True
+
+    def __init__(self, path: str, journal_path: Optional[str] = None,
+                 sync_every: int = 64, sync_interval: float = 1.0,
+                 compact_every: int = 10000):
+        self.path = path
+        self.journal_path = journal_path or path + '.journal'
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        self.compact_every = compact_every
+        self._unsynced = 0
+        self._journal_entries = 0
+        self._last_sync = time.monotonic()
+        self._journal = None
+
+    def load(self) -> Dict[str, Dict[str, dict]]:
+        state = {}
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                state = json.load(f)
+        for entry in self._read_journal():
+            records = state.setdefault(entry['c'], {})
+            if entry['op'] == 'put':
+                records[entry['k']] = entry['r']
             else:
-                price = rule.apply(price)
-        return price
+                records.pop(entry['k'], None)
+        return state
+
+    def load_collection(self, collection: str) -> Iterator[Tuple[str, dict]]:
+        # Latest journal state per key (None = deleted) overrides the snapshot
+        changes = {}
+        for entry in self._read_journal():
+            if entry['c'] == collection:
+                changes[entry['k']] = entry['r'] if entry['op'] == 'put' else None
+        for key, record in _iter_json_collection(self.path, collection):
+            if key in changes:
+                record = changes.pop(key)
+                if record is None:
+                    continue
+            yield key, record
+        for key, record in changes.items():
+            if record is not None:
+                yield key, record
+
+    def _read_journal(self) -> List[dict]:
+        entries = []
+        if os.path.exists(self.journal_path):
+            with open(self.journal_path) as f:
+                for line in f:
+                    # A torn write leaves a partial last line with no newline
+                    if not line.endswith('\n'):
+                        break
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        break
+                    if entry['op'] == 'batch':
+                        entries.extend(entry['e'])
+                    else:
+                        entries.append(entry)
+        self._journal_entries = len(entries)
+        return entries
+
+    def save(self, state: Dict[str, Dict[str, dict]]):
+        # The snapshot already contains everything still unsynced
+        _write_json_atomic(self.path, state)
+        if self._journal is not None:
+            self._journal.close()
+        self._journal = open(self.journal_path, 'w')
+        self._unsynced = 0
+        self._journal_entries = 0
+        self._last_sync = time.monotonic()
+
+    def put(self, collection: str, key: str, record: dict):
+        self._append({'op': 'put', 'c': collection, 'k': key, 'r': record})
+
+    def put_many(self, collection: str, records: Iterable[Tuple[str, dict]]):
+        # One write and fsync for the whole batch
+        lines = [json.dumps({'op': 'put', 'c': collection, 'k': key, 'r': record}, default=str)
+                 for key, record in records]
+        if lines:
+            self._write_lines(lines)
+        self.flush()
+
+    def put_batch(self, batch: Dict[str, List[Tuple[str, dict]]]):
+        # A single journal line, so a torn write loses the whole batch
+        # rather than leaving part of it behind
+        entries = [{'op': 'put', 'c': collection, 'k': key, 'r': record}
+                   for collection, records in batch.items() for key, record in records]
+        if entries:
+            self._write_lines([json.dumps({'op': 'batch', 'e': entries}, default=str)],
+                              len(entries))
+        self.flush()
+
+    def delete(self, collection: str, key: str):
+        self._append({'op': 'del', 'c': collection, 'k': key})
+
+    def _append(self, entry: dict):
+        self._write_lines([json.dumps(entry, default=str)])
+        if (self._unsynced >= self.sync_every
+                or time.monotonic() - self._last_sync >= self.sync_interval):
+            self.flush()
+
+    def _write_lines(self, lines: List[str], entries: Optional[int] = None):
+        if self._journal is None:
+            self._cut_torn_tail()
+            self._journal = open(self.journal_path, 'a')
+        self._journal.write('\n'.join(lines) + '\n')
+        self._journal.flush()
+        self._unsynced += len(lines)
+        self._journal_entries += len(lines) if entries is None else entries
+
+    def _cut_torn_tail(self):
+        # Replay stops at a partial last line, so appending after one would
+        # glue every later entry onto it and lose them all; cut the journal
+        # back to its last complete line before appending
+        if not os.path.exists(self.journal_path):
+            return
+        with open(self.journal_path, 'r+b') as f:
+            end = f.seek(0, os.SEEK_END)
+            size = end
+            while end > 0:
+                start = max(0, end - 65536)
+                f.seek(start)
+                newline = f.read(end - start).rfind(b'\n')
+                if newline >= 0:
+                    end = start + newline + 1
+                    break
+                end = start
+            if end != size:
+                f.truncate(end)
+
+    def needs_compaction(self) -> bool:
+        return self._journal_entries >= self.compact_every
+
+    def flush(self):
+        if self._unsynced:
+            os.fsync(self._journal.fileno())
+            self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def close(self):
+        self.flush()
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+
+class SqliteStorage(StorageBackend):
+    # One row per record (JSON text) plus indexed columns for invoices and
+    # their items, so lookups and sales aggregates run as indexed queries.
+    # Every change is committed as it happens, so exiting without close()
+    # loses nothing. In WAL mode with synchronous=NORMAL commits are not
+    # fsynced individually (only at checkpoints), so an OS crash can lose the
+    # last few commits but never corrupts the database.
+    incremental = True
+
+    _SCHEMA = """
+        CREATE TABLE IF NOT EXISTS products (id TEXT PRIMARY KEY, record TEXT NOT NULL);
+        CREATE TABLE IF NOT EXISTS customers (id TEXT PRIMARY KEY, record TEXT NOT NULL);
+        CREATE TABLE IF NOT EXISTS users (id TEXT PRIMARY KEY, record TEXT NOT NULL);
+        CREATE TABLE IF NOT EXISTS invoices (
+            id TEXT PRIMARY KEY,
+            customer_id TEXT,
+            date TEXT,
+            status TEXT,
+            total REAL,
+            record TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS invoice_items (
+            invoice_id TEXT NOT NULL,
+            product_id TEXT NOT NULL,
+            quantity INTEGER NOT NULL,
+            total REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_invoices_date ON invoices (date);
+        CREATE INDEX IF NOT EXISTS idx_invoices_customer ON invoices (customer_id);
+        CREATE INDEX IF NOT EXISTS idx_invoices_status ON invoices (status);
+        CREATE INDEX IF NOT EXISTS idx_items_product ON invoice_items (product_id);
+        CREATE INDEX IF NOT EXISTS idx_items_invoice ON invoice_items (invoice_id);
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(self._SCHEMA)
+
+    random_access = True
+
+    def load(self) -> Dict[str, Dict[str, dict]]:
+        return {collection: dict(self.load_collection(collection)) for collection in _COLLECTIONS}
+
+    def load_collection(self, collection: str) -> Iterator[Tuple[str, dict]]:
+        for key, record in self._conn.execute(f"SELECT id, record FROM {collection}"):
+            yield key, json.loads(record)
+
+    def load_record(self, collection: str, key: str) -> Optional[dict]:
+        row = self._conn.execute(
+            f"SELECT record FROM {collection} WHERE id = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save(self, state: Dict[str, Dict[str, dict]]):
+        with self._conn:
+            for collection in _COLLECTIONS:
+                self._conn.execute(f"DELETE FROM {collection}")
+            self._conn.execute("DELETE FROM invoice_items")
+            for collection in _COLLECTIONS:
+                for key, record in state.get(collection, {}).items():
+                    self._write(collection, key, record)
+
+    def put(self, collection: str, key: str, record: dict):
+        with self._conn:
+            self._write(collection, key, record)
+
+    def put_many(self, collection: str, records: Iterable[Tuple[str, dict]]):
+        self.put_batch({collection: records})
+
+    def put_batch(self, batch: Dict[str, List[Tuple[str, dict]]]):
+        # One transaction for the whole batch
+        with self._conn:
+            for collection, records in batch.items():
+                if collection == 'invoices':
+                    for key, record in records:
+                        self._write(collection, key, record)
+                else:
+                    self._conn.executemany(
+                        f"INSERT OR REPLACE INTO {collection} (id, record) VALUES (?, ?)",
+                        ((key, json.dumps(record, default=str)) for key, record in records))
+
+    def delete(self, collection: str, key: str):
+        with self._conn:
+            self._conn.execute(f"DELETE FROM {collection} WHERE id = ?", (key,))
+            if collection == 'invoices':
+                self._conn.execute("DELETE FROM invoice_items WHERE invoice_id = ?", (key,))
+
+    def _write(self, collection: str, key: str, record: dict):
+        text = json.dumps(record, default=str)
+        if collection != 'invoices':
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO {collection} (id, record) VALUES (?, ?)", (key, text))
+            return
+        self._conn.execute(
+            "INSERT OR REPLACE INTO invoices (id, customer_id, date, status, total, record) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (key, record.get('customer_id'), _date_key(record.get('date')),
+             record.get('status'), record.get('total'), text))
+        self._conn.execute("DELETE FROM invoice_items WHERE invoice_id = ?", (key,))
+        self._conn.executemany(
+            "INSERT INTO invoice_items (invoice_id, product_id, quantity, total) VALUES (?, ?, ?, ?)",
+            [(key, item['product_id'], item['quantity'], item['total'])
+             for item in record.get('items', [])])
+
+    def flush(self):
+        self._conn.commit()
+
+    def close(self):
+        self.flush()
+        self._conn.close()
+
+    # Indexed queries
+    def find_invoice_ids(self, customer_id: Optional[str] = None, status: Optional[str] = None,
+                         product_id: Optional[str] = None, start_date: Optional[str] = None,
+                         end_date: Optional[str] = None) -> List[str]:
+        query = "SELECT DISTINCT v.id FROM invoices v"
+        clauses, params = [], []
+        if product_id is not None:
+            query += " JOIN invoice_items i ON i.invoice_id = v.id"
+            clauses.append("i.product_id = ?")
+            params.append(product_id)
+        if customer_id is not None:
+            clauses.append("v.customer_id = ?")
+            params.append(customer_id)
+        if status is not None:
+            clauses.append("v.status = ?")
+            params.append(status)
+        if start_date:
+            clauses.append("v.date >= ?")
+            params.append(_date_key(start_date))
+        if end_date:
+            clauses.append("v.date <= ?")
+            params.append(_date_key(end_date))
+        if clauses:
+            query += " WHERE " + " AND ".join(clauses)
+        query += " ORDER BY v.date, v.id"
+        return [row[0] for row in self._conn.execute(query, params)]
+
+    def sales_aggregates(self, status: str) -> Tuple[Dict[str, list], Dict[str, dict]]:
+        product_totals = {
+            product_id: [units, revenue, lines]
+            for product_id, units, revenue, lines in self._conn.execute(
+                "SELECT i.product_id, SUM(i.quantity), SUM(i.total), COUNT(*) "
+                "FROM invoice_items i JOIN invoices v ON v.id = i.invoice_id "
+                "WHERE v.status = ? GROUP BY i.product_id", (status,))
+        }
+        customer_stats = {
+            customer_id: {
+                'total_spent': spent,
+                'total_invoices': count,
+                'items_bought': items
+            }
+            for customer_id, spent, count, items in self._conn.execute(
+                "SELECT v.customer_id, SUM(v.total), COUNT(*), SUM(COALESCE(q.units, 0)) "
+                "FROM invoices v LEFT JOIN ("
+                "    SELECT invoice_id, SUM(quantity) AS units FROM invoice_items GROUP BY invoice_id"
+                ") q ON q.invoice_id = v.id "
+                "WHERE v.status = ? GROUP BY v.customer_id", (status,))
+        }
+        return product_totals, customer_stats
+
+class LazyRecords(MutableMapping):
+    # Dict-like collection that is only decoded from storage when first
+    # used. Backends with random access serve single-key lookups without
+    # loading the rest; anything that needs the whole collection (iteration,
+    # len, reports) materializes it once, keeping objects already handed out.
+    def __init__(self, storage: StorageBackend, collection: str,
+                 from_record: Callable[[dict], object], lock=None):
+        self._storage = storage
+        self._collection = collection
+        self._from_record = from_record
+        self._data: Optional[dict] = None
+        self._fetched: dict = {}
+        self._deleted: set = set()
+        # Guards storage reads. Materializing must happen once even when
+        # threads race to it, or a late finisher drops records inserted
+        # meanwhile. The owning system passes its writer lock so reads never
+        # interleave with its storage writes.
+        self._load_lock = lock if lock is not None else threading.RLock()
+
+    @property
+    def loaded(self) -> bool:
+        return self._data is not None
+
+    def _records(self) -> dict:
+        if self._data is not None:
+            return self._data
+        with self._load_lock:
+            if self._data is not None:
+                return self._data
+            data = {}
+            for key, record in self._storage.load_collection(self._collection):
+                if key in self._deleted:
+                    continue
+                obj = self._fetched.get(key)
+                data[key] = obj if obj is not None else self._from_record(record)
+            data.update(self._fetched)
+            self._data = data
+            self._fetched = {}
+            self._deleted = set()
+        return self._data
+
+    def __getitem__(self, key):
+        if self._data is None and self._storage.random_access and key not in self._deleted:
+            obj = self._fetched.get(key)
+            if obj is None:
+                with self._load_lock:
+                    obj = self._fetched.get(key)
+                    if obj is None:
+                        record = self._storage.load_record(self._collection, key)
+                        if record is None:
+                            raise KeyError(key)
+                        obj = self._fetched[key] = self._from_record(record)
+            return obj
+        return self._records()[key]
+
+    def __setitem__(self, key, value):
+        if self._data is None and self._storage.random_access:
+            self._fetched[key] = value
+            self._deleted.discard(key)
+        else:
+            self._records()[key] = value
+
+    def __delitem__(self, key):
+        if self._data is None and self._storage.random_access:
+            self[key]
+            self._fetched.pop(key, None)
+            self._deleted.add(key)
+        else:
+            del self._records()[key]
+
+    def __contains__(self, key) -> bool:
+        try:
+            self[key]
+        except KeyError:
+            return False
+        return True
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __iter__(self):
+        return iter(self._records())
+
+    def __len__(self) -> int:
+        return len(self._records())
+
+    def keys(self):
+        return self._records().keys()
+
+    def values(self):
+        return self._records().values()
+
+    def items(self):
+        return self._records().items()
+
+# Price cache
+class PriceCache:
+    # LRU cache of quoted prices keyed on (product_id, quantity), with an
+    # optional TTL in seconds. The owning system drops a product's entries
+    # when its price or discount rules change. Safe to share between threads.
+    # Invalidation bumps a per-product generation (clear bumps all of them);
+    # callers read generation() before pricing and pass it to put, which
+    # drops a price computed before a concurrent invalidation.
+    def __init__(self, maxsize: int = 10000, ttl: Optional[float] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict = OrderedDict()
+        self._keys_by_product: Dict[str, set] = {}
+        self._generations: Dict[str, int] = {}
+        self._epoch = 0
+        self._lock = threading.Lock()
+
+    def generation(self, product_id: str) -> Tuple[int, int]:
+        with self._lock:
+            return self._epoch, self._generations.get(product_id, 0)
+
+    def get(self, product_id: str, quantity: int) -> Optional[float]:
+        key = (product_id, quantity)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            price, expires = entry
+            if expires is not None and expires < time.monotonic():
+                self._discard(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return price
+
+    def put(self, product_id: str, quantity: int, price: float,
+            generation: Optional[Tuple[int, int]] = None):
+        if self.maxsize <= 0:
+            return
+        key = (product_id, quantity)
+        expires = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            if (generation is not None
+                    and generation != (self._epoch, self._generations.get(product_id, 0))):
+                return
+            self._entries[key] = (price, expires)
+            self._entries.move_to_end(key)
+            self._keys_by_product.setdefault(product_id, set()).add(quantity)
+            while len(self._entries) > self.maxsize:
+                oldest, _ = self._entries.popitem(last=False)
+                self._forget(oldest)
+
+    def _discard(self, key: tuple):
+        del self._entries[key]
+        self._forget(key)
+
+    def _forget(self, key: tuple):
+        product_id, quantity = key
+        quantities = self._keys_by_product.get(product_id)
+        if quantities is not None:
+            quantities.discard(quantity)
+            if not quantities:
+                del self._keys_by_product[product_id]
+
+    def invalidate_product(self, product_id: str):
+        with self._lock:
+            self._generations[product_id] = self._generations.get(product_id, 0) + 1
+            for quantity in self._keys_by_product.pop(product_id, ()):
+                self._entries.pop((product_id, quantity), None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._keys_by_product.clear()
+            self._generations.clear()
+            self._epoch += 1
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self._entries),
+            'maxsize': self.maxsize,
+            'hit_rate': self.hits / lookups if lookups else 0.0
+        }
+
+# Columnar catalog view
+class CatalogColumns:
+    # price / quantity / reorder_level / category code as parallel arrays,
+    # one row per product, so bulk stock questions are answered in a single
+    # vectorized pass. Uses NumPy when installed and compact array.array
+    # columns otherwise. Field changes are applied to the row in place;
+    # adding or removing products triggers a rebuild by the owning system.
+    def __init__(self, products: Dict[str, Product]):
+        self.ids = list(products)
+        self._rows = {product_id: row for row, product_id in enumerate(self.ids)}
+        self.categories: List['ProductCategory'] = []
+        self._category_codes: Dict['ProductCategory', int] = {}
+        values = products.values()
+        price = array('d', (p.price for p in values))
+        quantity = array('q', (p.quantity for p in values))
+        reorder_level = array('q', (p.reorder_level for p in values))
+        category = array('l', (self._category_code(p.category) for p in values))
+        if np is not None:
+            self.price = np.array(price, dtype=np.float64)
+            self.quantity = np.array(quantity, dtype=np.int64)
+            self.reorder_level = np.array(reorder_level, dtype=np.int64)
+            self.category = np.array(category, dtype=np.int64)
+        else:
+            self.price = price
+            self.quantity = quantity
+            self.reorder_level = reorder_level
+            self.category = category
+
+    def _category_code(self, category: 'ProductCategory') -> int:
+        code = self._category_codes.get(category)
+        if code is None:
+            code = self._category_codes[category] = len(self.categories)
+            self.categories.append(category)
+        return code
+
+    def update(self, product: Product, name: str):
+        row = self._rows.get(product.id)
+        if row is None:
+            return
+        if name == 'category':
+            self.category[row] = self._category_code(product.category)
+        else:
+            getattr(self, name)[row] = getattr(product, name)
+
+    def total_stock_value(self) -> float:
+        if np is not None:
+            return float(np.dot(self.price, self.quantity))
+        return math.fsum(map(operator.mul, self.price, self.quantity))
+
+    def low_stock_ids(self) -> List[str]:
+        if np is not None:
+            rows = np.flatnonzero(self.quantity <= self.reorder_level)
+        else:
+            rows = [row for row, (quantity, level)
+                    in enumerate(zip(self.quantity, self.reorder_level)) if quantity <= level]
+        return [self.ids[row] for row in rows]
+
+    def value_by_category(self) -> Dict['ProductCategory', float]:
+        if np is not None:
+            totals = np.bincount(self.category, weights=self.price * self.quantity,
+                                 minlength=len(self.categories))
+        else:
+            totals = [0.0] * len(self.categories)
+            for code, price, quantity in zip(self.category, self.price, self.quantity):
+                totals[code] += price * quantity
+        return {category: float(totals[code]) for code, category in enumerate(self.categories)}
+
+def open_storage(path: str) -> StorageBackend:
+    if os.path.splitext(path)[1] in ('.db', '.sqlite', '.sqlite3'):
+        return SqliteStorage(path)
+    return JournalStorage(path)
+
+def migrate_storage(source: StorageBackend, target: StorageBackend):
+    target.save(source.load())
+    target.close()
+    source.close()
+
+# Low-stock watchlist
+class LowStockWatchlist:
+    # Products at or below their reorder level, kept sorted by urgency
+    # (stock as a fraction of reorder level, then id) and updated on every
+    # quantity or reorder_level change, so listing them is O(k) instead of a
+    # catalog scan. Listeners are called with the product whenever it drops
+    # into the list; they run in the thread that changed the stock, so they
+    # should be quick (hand off anything slow).
+    def __init__(self):
+        self._keys: List[Tuple[float, str]] = []  # sorted
+        self._key_of: Dict[str, Tuple[float, str]] = {}
+        self._listeners: List[Callable[[Product], None]] = []
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _urgency(product: Product) -> Tuple[float, str]:
+        if product.reorder_level <= 0:
+            return (0.0, product.id)
+        return (product.quantity / product.reorder_level, product.id)
+
+    def add_listener(self, callback: Callable[[Product], None]):
+        self._listeners.append(callback)
+
+    def rebuild(self, products: Iterable[Product]):
+        with self._lock:
+            self._key_of = {product.id: self._urgency(product) for product in products
+                            if product.quantity <= product.reorder_level}
+            self._keys = sorted(self._key_of.values())
+
+    def update(self, product: Product):
+        low = product.quantity <= product.reorder_level
+        with self._lock:
+            old_key = self._key_of.pop(product.id, None)
+            if old_key is not None:
+                del self._keys[bisect.bisect_left(self._keys, old_key)]
+            if low:
+                key = self._key_of[product.id] = self._urgency(product)
+                bisect.insort(self._keys, key)
+        if low and old_key is None:
+            for callback in self._listeners:
+                try:
+                    callback(product)
+                except Exception:
+                    if METRICS.enabled:
+                        METRICS.inc('low_stock_listener_errors_total')
+
+    def discard(self, product_id: str):
+        with self._lock:
+            key = self._key_of.pop(product_id, None)
+            if key is not None:
+                del self._keys[bisect.bisect_left(self._keys, key)]
+
+    def ids(self, limit: Optional[int] = None) -> List[str]:
+        with self._lock:
+            keys = self._keys if limit is None else self._keys[:limit]
+            return [product_id for _, product_id in keys]
+
+    def __contains__(self, product_id: str) -> bool:
+        return product_id in self._key_of
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+# Bulk import
+def _open_feed(path: str):
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', newline='')
+    return open(path, newline='')
+
+def _iter_feed_rows(path: str, format: Optional[str] = None) -> Iterator[Tuple[int, object]]:
+    # (line number, row) pairs from a CSV or JSONL feed, optionally gzipped.
+    # JSONL rows come through as the raw line so bad JSON is rejected per row.
+    if format is None:
+        name = path[:-3] if path.endswith('.gz') else path
+        format = 'jsonl' if name.endswith(('.jsonl', '.ndjson')) else 'csv'
+    if format not in ('csv', 'jsonl'):
+        raise ValueError(f"Unknown feed format: {format}")
+    with _open_feed(path) as f:
+        if format == 'csv':
+            reader = csv.DictReader(f)
+            for row in reader:
+                yield reader.line_num, row
+        else:
+            for number, line in enumerate(f, 1):
+                if line.strip():
+                    yield number, line.strip()
+
+def _feed_number(row: dict, name: str, kind: type, default=None):
+    value = row.get(name)
+    if value is None or value == '':
+        if default is None:
+            raise ValueError(f"Missing {name}")
+        return default
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid {name}: {value!r}")
+    if not math.isfinite(number) or number < 0 or (kind is int and not number.is_integer()):
+        raise ValueError(f"Invalid {name}: {value!r}")
+    return kind(number)
+
+def _feed_category(value) -> 'ProductCategory':
+    try:
+        return ProductCategory(value)
+    except ValueError:
+        pass
+    try:
+        return ProductCategory[str(value).strip().upper()]
+    except KeyError:
+        raise ValueError(f"Unknown category: {value!r}")
+
+def _product_from_row(row) -> Product:
+    if isinstance(row, str):
+        try:
+            row = json.loads(row)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Invalid JSON: {e.msg}")
+    if not isinstance(row, dict):
+        raise ValueError("Row is not an object")
+    product_id = str(row.get('id') or '').strip()
+    name = str(row.get('name') or '').strip()
+    if not product_id:
+        raise ValueError("Missing id")
+    if not name:
+        raise ValueError("Missing name")
+    rules = row.get('discount_rules') or None
+    if rules is not None:
+        try:
+            rules = [_rule_from_record(rule) for rule in rules]
+        except (TypeError, KeyError, ValueError, AttributeError):
+            raise ValueError(f"Invalid discount_rules: {rules!r}")
+    return Product(
+        id=product_id,
+        name=name,
+        price=_feed_number(row, 'price', float),
+        quantity=_feed_number(row, 'quantity', int),
+        category=_feed_category(row.get('category')),
+        reorder_level=_feed_number(row, 'reorder_level', int, 10),
+        discount_rules=rules
+    )
+
+def _invoice_from_row(row) -> 'Invoice':
+    if not isinstance(row, dict):
+        raise ValueError("Row is not an object")
+    invoice_id = str(row.get('id') or '').strip()
+    customer_id = str(row.get('customer_id') or '').strip()
+    if not invoice_id:
+        raise ValueError("Missing id")
+    if not customer_id:
+        raise ValueError("Missing customer_id")
+    date = row.get('date')
+    try:
+        datetime.date.fromisoformat(_date_key(date))
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid date: {date!r}")
+    try:
+        status = InvoiceStatus(row.get('status'))
+    except ValueError:
+        raise ValueError(f"Invalid status: {row.get('status')!r}")
+    lines = row.get('items')
+    if not isinstance(lines, list) or not lines:
+        raise ValueError("Missing items")
+    items = []
+    for line in lines:
+        if not isinstance(line, dict) or not str(line.get('product_id') or '').strip():
+            raise ValueError(f"Invalid item: {line!r}")
+        quantity = _feed_number(line, 'quantity', int)
+        if quantity == 0:
+            raise ValueError(f"Invalid quantity: {line.get('quantity')!r}")
+        items.append(InvoiceItem(str(line['product_id']).strip(), quantity,
+                                 _feed_number(line, 'unit_price', float)))
+    return Invoice(invoice_id, customer_id, date, status, items,
+                   _feed_number(row, 'tax_rate', float, 0.0))
+
+def _parse_invoice_chunk(first_line: int, lines: List[bytes]
+                         ) -> Tuple[List[Tuple[int, 'Invoice']], List[Tuple[int, str, str]]]:
+    # Process pool worker: JSONL lines -> validated invoices and
+    # (line number, error, raw row) rejects
+    parsed, rejects = [], []
+    for number, line in enumerate(lines, first_line):
+        text = line.decode('utf-8', 'replace').strip()
+        if not text:
+            continue
+        try:
+            try:
+                row = json.loads(text)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"Invalid JSON: {e.msg}")
+            parsed.append((number, _invoice_from_row(row)))
+        except ValueError as e:
+            rejects.append((number, str(e), text))
+    return parsed, rejects
+
+def _iter_byte_chunks(path: str, offset: int, first_line: int,
+                      chunk_size: int) -> Iterator[Tuple[int, List[bytes], int]]:
+    # (first line number, lines, offset just past the chunk) from offset on
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        while True:
+            lines = list(itertools.islice(f, chunk_size))
+            if not lines:
+                return
+            offset += sum(len(line) for line in lines)
+            yield first_line, lines, offset
+            first_line += len(lines)
+
+# Stock reservations
+@dataclass(slots=True)
+class Reservation:
+    id: str
+    lines: Dict[str, int]
+    expires: float
+
+class StockReservations:
+    # Holds stock for in-flight orders. reserve() claims units against a
+    # product's quantity minus what other reservations already hold,
+    # commit() turns the hold into a real decrement and release() (or the
+    # ttl running out) hands it back. Holds are counted under the owning
+    # system's per-product stock stripes, so orders for different SKUs never
+    # contend; the reservation table has its own short lock. Holds live in
+    # memory only and do not survive a restart.
+    def __init__(self, system: 'InventorySystem', ttl: float = 900.0):
+        self.system = system
+        self.ttl = ttl
+        self.held: Dict[str, int] = {}
+        self._reservations: Dict[str, Reservation] = {}
+        self._expiry: List[Tuple[float, str]] = []  # heap of (expires, reservation id)
+        self._lock = threading.Lock()
+
+    def available(self, product_id: str) -> int:
+        return self.system.products[product_id].quantity - self.held.get(product_id, 0)
+
+    def reserve(self, lines: Iterable[Tuple[str, int]], ttl: Optional[float] = None) -> Reservation:
+        self.expire()
+        wanted: Dict[str, int] = {}
+        for product_id, quantity in lines:
+            if quantity <= 0:
+                raise ValueError(f"Quantity must be positive for {product_id}")
+            wanted[product_id] = wanted.get(product_id, 0) + quantity
+        if not wanted:
+            raise ValueError("Nothing to reserve")
+        products = self.system.products
+        for product_id in wanted:
+            if product_id not in products:
+                raise KeyError(product_id)
+
+        with self._stock_locks(wanted):
+            short = [product_id for product_id, quantity in wanted.items()
+                     if products[product_id].quantity - self.held.get(product_id, 0) < quantity]
+            if short:
+                raise ValueError(f"Insufficient stock for {', '.join(short)}")
+            for product_id, quantity in wanted.items():
+                self.held[product_id] = self.held.get(product_id, 0) + quantity
 
+        expires = time.monotonic() + (self.ttl if ttl is None else ttl)
+        reservation = Reservation(secrets.token_hex(8), wanted, expires)
+        with self._lock:
+            self._reservations[reservation.id] = reservation
+            heapq.heappush(self._expiry, (expires, reservation.id))
+        return reservation
+
+    def commit(self, reservation_id: str):
+        try:
+            reservation = self._take(reservation_id)
+        except KeyError:
+            raise ValueError(f"Unknown or expired reservation: {reservation_id}")
+        if reservation.expires < time.monotonic():
+            self._unhold(reservation)
+            raise ValueError(f"Reservation {reservation_id} has expired")
+        products = self.system.products
+        with self._stock_locks(reservation.lines):
+            for product_id, quantity in reservation.lines.items():
+                self._unhold_line(product_id, quantity)
+                product = products.get(product_id)
+                if product is not None:
+                    product.quantity -= quantity
+        for product_id in reservation.lines:
+            self.system._persist('products', product_id)
+
+    def release(self, reservation_id: str) -> bool:
+        try:
+            reservation = self._take(reservation_id)
+        except KeyError:
+            return False
+        self._unhold(reservation)
+        return True
+
+    def expire(self) -> int:
+        now = time.monotonic()
+        expired = []
+        with self._lock:
+            while self._expiry and self._expiry[0][0] <= now:
+                _, reservation_id = heapq.heappop(self._expiry)
+                reservation = self._reservations.pop(reservation_id, None)
+                if reservation is not None:
+                    expired.append(reservation)
+        for reservation in expired:
+            self._unhold(reservation)
+        return len(expired)
+
+    def _take(self, reservation_id: str) -> Reservation:
+        with self._lock:
+            reservation = self._reservations.pop(reservation_id)
+            # Committed and released entries stay in the heap until they
+            # time out; rebuild it when they dominate
+            if len(self._expiry) > 2 * len(self._reservations) + 64:
+                self._expiry = [(r.expires, r.id) for r in self._reservations.values()]
+                heapq.heapify(self._expiry)
+        return reservation
+
+    def _unhold(self, reservation: Reservation):
+        with self._stock_locks(reservation.lines):
+            for product_id, quantity in reservation.lines.items():
+                self._unhold_line(product_id, quantity)
+
+    def _unhold_line(self, product_id: str, quantity: int):
+        remaining = self.held[product_id] - quantity
+        if remaining:
+            self.held[product_id] = remaining
+        else:
+            del self.held[product_id]
+
+    def _stock_locks(self, product_ids: Iterable[str]) -> contextlib.ExitStack:
+        return self.system._stock_locks_for(product_ids)
+
+    def __len__(self) -> int:
+        return len(self._reservations)
+
+# Concurrency model: one InventorySystem may be shared by many threads.
+# - Structural changes (adding or removing products, customers, users and
+#   invoices, invoice edits, index and aggregate maintenance) and every
+#   storage write run under one re-entrant writer lock, self._lock.
+# - Stock changes take only the lock stripe that product id hashes to, so
+#   adjustments to different products proceed in parallel and concurrent
+#   adjustments to one product are never lost. Change stock through
+#   adjust_stock, not by assigning product.quantity directly.
+# - Lock order is stripe -> writer lock, never the other way round.
+# - The columnar catalog view has its own lock, always taken last and never
+#   held while taking another, so stock changes keep it current without
+#   contending on the writer lock.
+# - products, customers and users are copy-on-write: writers build a new
+#   dict and swap it in, so readers use whichever dict they picked up
+#   without locking and never see one change size mid-iteration.
+#   snapshot() returns read-only views of all three from one instant.
+#   The price is an O(n) copy per single add (a few ms at 300k products);
+#   load catalogs through add_products/import_products, which copy once
+#   per batch.
+# - Invoice queries copy what they need from the indexes and aggregates
+#   under the writer lock, then build results outside it.
 class InventorySystem:
-    def __init__(self, data_file: str = "inventory_data.json"):
+    def __init__(self, data_file: str = "inventory_data.json",
+                 storage: Optional[StorageBackend] = None, lazy: bool = True,
+                 price_cache_size: int = 10000, price_cache_ttl: Optional[float] = None,
+                 session_ttl: float = 3600.0, max_sessions: int = 10000,
+                 lock_stripes: int = 64, reservation_ttl: float = 900.0):
         self.data_file = data_file
+        self.storage = storage if storage is not None else open_storage(data_file)
+        # Invoices are decoded on first use rather than at startup
+        self.lazy = lazy
         self.products: Dict[str, Product] = {}
         self.customers: Dict[str, Customer] = {}
         self.invoices: Dict[str, Invoice] = {}
         self.users: Dict[str, User] = {}
+        # Columnar view of self.products, built on first use. Products must
+        # be added/removed through add_product/remove_product so it notices.
+        self._columns: Optional[CatalogColumns] = None
+        self._columns_lock = threading.Lock()
+        self.price_cache = PriceCache(price_cache_size, price_cache_ttl)
+        self.sessions = SessionManager(session_ttl, max_sessions)
+        # Running [units, revenue, paid_lines] per product over PAID invoices
+        self._product_totals: Dict[str, list] = {}
+        # total_spent / total_invoices / items_bought per customer, same rules
+        self._customer_stats: Dict[str, dict] = {}
+        self._aggregates_ready = False
+        # Invoice indexes, built on first use (None until then): dates
+        # (YYYY-MM-DD) kept sorted with ids in the same order, plus
+        # customer_id / product_id / status -> invoice ids
+        self._invoice_dates: Optional[List[str]] = None
+        self._invoice_date_ids: List[str] = []
+        self._invoices_by_customer: Dict[str, set] = {}
+        self._invoices_by_product: Dict[str, set] = {}
+        self._invoices_by_status: Dict['InvoiceStatus', set] = {}
+        self._lock = threading.RLock()
+        self._stock_locks = [threading.Lock() for _ in range(lock_stripes)]
+        self.reservations = StockReservations(self, reservation_ttl)
+        self.low_stock = LowStockWatchlist()
         self.load_data()
 
+    # Data persistence
+    @instrumented('load')
+    def load_data(self):
+        with self._lock:
+            for collection, (_, from_record) in _COLLECTIONS.items():
+                if collection == 'invoices' and self.lazy:
+                    self.invoices = LazyRecords(self.storage, collection, from_record, self._lock)
+                    continue
+                setattr(self, collection, {
+                    key: from_record(record)
+                    for key, record in self.storage.load_collection(collection)
+                })
+            for product in self.products.values():
+                product._observer = self._product_changed
+            self.low_stock.rebuild(self.products.values())
+            self._drop_columns()
+            self.price_cache.clear()
+            # Built on first use so startup never touches invoice history
+            self._aggregates_ready = False
+            self._invoice_dates = None
+
+    @instrumented('save')
+    def save_data(self):
+        with self._lock:
+            self.storage.save(self._export_state())
+
+    def _export_state(self) -> Dict[str, Dict[str, dict]]:
+        return {
+            collection: {key: to_record(obj) for key, obj in getattr(self, collection).items()}
+            for collection, (to_record, _) in _COLLECTIONS.items()
+        }
+
+    def _persist(self, collection: str, key: str):
+        with self._lock:
+            if not self.storage.incremental:
+                self.save_data()
+                return
+            obj = getattr(self, collection).get(key)
+            if obj is None:
+                self.storage.delete(collection, key)
+            else:
+                self.storage.put(collection, key, _COLLECTIONS[collection][0](obj))
+            if self.storage.needs_compaction():
+                self.save_data()
+
+    def _persist_many(self, collection: str, keys: Iterable[str]):
+        self._persist_batch({collection: keys})
+
+    def _persist_batch(self, keys_by_collection: Dict[str, Iterable[str]]):
+        # All collections are written as one atomic unit
+        with self._lock:
+            if not self.storage.incremental:
+                self.save_data()
+                return
+            batch = {}
+            for collection, keys in keys_by_collection.items():
+                objects = getattr(self, collection)
+                to_record = _COLLECTIONS[collection][0]
+                batch[collection] = [(key, to_record(objects[key])) for key in keys]
+            self.storage.put_batch(batch)
+            if self.storage.needs_compaction():
+                self.save_data()
+
+    def close(self):
+        with self._lock:
+            self.storage.close()
+
+    def snapshot(self) -> Dict[str, MappingProxyType]:
+        with self._lock:
+            return {'products': MappingProxyType(self.products),
+                    'customers': MappingProxyType(self.customers),
+                    'users': MappingProxyType(self.users)}
+
+    # Catalog, customers and users
+    def add_product(self, product: Product):
+        product._observer = self._product_changed
+        with self._stock_lock(product.id), self._lock:
+            previous = self.products.get(product.id)
+            if previous is not None and previous is not product:
+                previous._observer = None
+            self.products = {**self.products, product.id: product}
+            self.low_stock.update(product)
+            self._drop_columns()
+            self.price_cache.invalidate_product(product.id)
+            self._persist('products', product.id)
+
+    def remove_product(self, product_id: str):
+        with self._stock_lock(product_id), self._lock:
+            products = dict(self.products)
+            product = products.pop(product_id)
+            self.products = products
+            product._observer = None
+            self.low_stock.discard(product_id)
+            self._drop_columns()
+            self.price_cache.invalidate_product(product_id)
+            self._persist('products', product_id)
+
+    def add_products(self, products: Iterable[Product]):
+        # One catalog swap and one storage write for the whole batch
+        products = list(products)
+        with self._lock:
+            catalog = dict(self.products)
+            for product in products:
+                previous = catalog.get(product.id)
+                if previous is not None and previous is not product:
+                    previous._observer = None
+                product._observer = self._product_changed
+                catalog[product.id] = product
+                self.price_cache.invalidate_product(product.id)
+            self.products = catalog
+            for product in products:
+                self.low_stock.update(product)
+            self._drop_columns()
+            self._persist_many('products', [product.id for product in products])
+
+    @instrumented('import_products')
+    def import_products(self, path: str, format: Optional[str] = None, batch_size: int = 5000,
+                        rejects_path: Optional[str] = None) -> Dict[str, float]:
+        # Streams a CSV or JSONL feed into the catalog batch_size rows at a
+        # time. Rows that fail validation are skipped and, with rejects_path,
+        # listed in a CSV of line number, error and the raw row.
+        if batch_size <= 0:
+            raise ValueError("batch_size must be positive")
+        imported = rejected = 0
+        start = time.perf_counter()
+        with contextlib.ExitStack() as stack:
+            rejects = None
+            batch = []
+            for line, row in _iter_feed_rows(path, format):
+                try:
+                    batch.append(_product_from_row(row))
+                except ValueError as e:
+                    rejected += 1
+                    if rejects_path is not None:
+                        if rejects is None:
+                            rejects = csv.writer(stack.enter_context(
+                                open(rejects_path, 'w', newline='')))
+                            rejects.writerow(['line', 'error', 'row'])
+                        rejects.writerow([line, str(e), row if isinstance(row, str)
+                                          else json.dumps(row, default=str)])
+                    continue
+                if len(batch) >= batch_size:
+                    self.add_products(batch)
+                    imported += len(batch)
+                    batch = []
+            if batch:
+                self.add_products(batch)
+                imported += len(batch)
+        elapsed = time.perf_counter() - start
+        return {
+            'imported': imported,
+            'rejected': rejected,
+            'seconds': elapsed,
+            'rows_per_sec': (imported + rejected) / elapsed if elapsed else 0.0
+        }
+
+    @instrumented('ingest_invoices')
+    def ingest_invoices(self, path: str, workers: Optional[int] = None, chunk_size: int = 2000,
+                        checkpoint_path: Optional[str] = None, rejects_path: Optional[str] = None,
+                        adjust_stock: bool = True) -> Dict[str, float]:
+        # Bulk load a JSONL file of invoices. A process pool parses and
+        # validates chunks of lines; this thread is the single writer and
+        # applies each chunk in file order as one batch (stock, aggregates,
+        # indexes, one storage write per collection). After every batch the
+        # byte offset reached is checkpointed, so an interrupted run picks up
+        # where it stopped. Invoice ids that already exist are skipped, which
+        # also makes replaying a batch after a crash harmless.
+        if chunk_size <= 0:
+            raise ValueError("chunk_size must be positive")
+        checkpoint_path = checkpoint_path or path + '.checkpoint'
+        source = os.path.abspath(path)
+        state = {'source': source, 'offset': 0, 'line': 1,
+                 'ingested': 0, 'rejected': 0, 'skipped': 0}
+        if os.path.exists(checkpoint_path):
+            with open(checkpoint_path) as f:
+                saved = json.load(f)
+            if saved.get('source') != source:
+                raise ValueError(f"Checkpoint {checkpoint_path} belongs to {saved.get('source')}")
+            state.update(saved)
+        resumed = state['offset'] > 0
+        in_flight = (workers or os.cpu_count() or 1) * 2
+        start = time.perf_counter()
+        ingested_before = state['ingested']
+
+        with contextlib.ExitStack() as stack:
+            rejects = None
+
+            def apply(future: concurrent.futures.Future, end_offset: int, next_line: int):
+                nonlocal rejects
+                parsed, rejected_rows = future.result()
+                ingested, skipped, refused = self._apply_invoice_batch(parsed, adjust_stock)
+                rejected_rows.extend(refused)
+                if rejected_rows and rejects_path is not None:
+                    if rejects is None:
+                        append = resumed and os.path.exists(rejects_path)
+                        rejects = csv.writer(stack.enter_context(
+                            open(rejects_path, 'a' if append else 'w', newline='')))
+                        if not append:
+                            rejects.writerow(['line', 'error', 'row'])
+                    rejects.writerows(sorted(rejected_rows))
+                state['ingested'] += ingested
+                state['skipped'] += skipped
+                state['rejected'] += len(rejected_rows)
+                state['offset'] = end_offset
+                state['line'] = next_line
+                _write_json_atomic(checkpoint_path, state)
+
+            pool = stack.enter_context(concurrent.futures.ProcessPoolExecutor(workers))
+            pending = deque()
+            for first_line, lines, end_offset in _iter_byte_chunks(
+                    path, state['offset'], state['line'], chunk_size):
+                pending.append((pool.submit(_parse_invoice_chunk, first_line, lines),
+                                end_offset, first_line + len(lines)))
+                if len(pending) >= in_flight:
+                    apply(*pending.popleft())
+            while pending:
+                apply(*pending.popleft())
+
+        if os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+        elapsed = time.perf_counter() - start
+        return {
+            'ingested': state['ingested'],
+            'rejected': state['rejected'],
+            'skipped': state['skipped'],
+            'seconds': elapsed,
+            'invoices_per_sec': (state['ingested'] - ingested_before) / elapsed if elapsed else 0.0
+        }
+
+    def _apply_invoice_batch(self, parsed: List[Tuple[int, 'Invoice']], adjust_stock: bool
+                             ) -> Tuple[int, int, List[Tuple[int, str, str]]]:
+        customers = self.customers
+        products = self.products
+        candidates, refused = [], []
+        for line, invoice in parsed:
+            missing = [item.product_id for item in invoice.items if item.product_id not in products]
+            if invoice.customer_id not in customers:
+                error = f"Unknown customer: {invoice.customer_id}"
+            elif missing:
+                error = f"Unknown product: {', '.join(missing)}"
+            else:
+                candidates.append((line, invoice))
+                continue
+            refused.append((line, error, json.dumps(_invoice_to_record(invoice), default=str)))
+
+        touched = {item.product_id for _, invoice in candidates for item in invoice.items}
+        accepted, accepted_ids, skipped = [], set(), 0
+        # Stripes before the writer lock, as everywhere else
+        with self._stock_locks_for(touched if adjust_stock else ()), self._lock:
+            taken: Dict[str, int] = {}
+            for line, invoice in candidates:
+                if invoice.id in accepted_ids or invoice.id in self.invoices:
+                    skipped += 1
+                    continue
+                if adjust_stock:
+                    wanted: Dict[str, int] = {}
+                    for item in invoice.items:
+                        wanted[item.product_id] = wanted.get(item.product_id, 0) + item.quantity
+                    short = [product_id for product_id, quantity in wanted.items()
+                             if products[product_id].quantity - taken.get(product_id, 0)
+                             - self.reservations.held.get(product_id, 0) < quantity]
+                    if short:
+                        refused.append((line, f"Insufficient stock for {', '.join(short)}",
+                                        json.dumps(_invoice_to_record(invoice), default=str)))
+                        continue
+                    for product_id, quantity in wanted.items():
+                        taken[product_id] = taken.get(product_id, 0) + quantity
+                accepted.append(invoice)
+                accepted_ids.add(invoice.id)
+
+            for product_id, quantity in taken.items():
+                products[product_id].quantity -= quantity
+            for invoice in accepted:
+                self.invoices[invoice.id] = invoice
+                self._attach_invoice(invoice)
+            # Stock and invoices in one atomic write: a crash can never keep
+            # the deduction while losing the invoices, which a resumed run
+            # would then ingest (and deduct) again
+            if accepted:
+                self._persist_batch({'products': list(taken),
+                                     'invoices': [invoice.id for invoice in accepted]})
+        return len(accepted), skipped, refused
+
+    def _stock_stripe(self, product_id: str) -> int:
+        return hash(product_id) % len(self._stock_locks)
+
+    def _stock_lock(self, product_id: str) -> threading.Lock:
+        return self._stock_locks[self._stock_stripe(product_id)]
+
+    def _stock_locks_for(self, product_ids: Iterable[str]) -> contextlib.ExitStack:
+        # Stripes are always taken in index order so two multi-product
+        # changes cannot deadlock on each other
+        stack = contextlib.ExitStack()
+        for stripe in sorted({self._stock_stripe(product_id) for product_id in product_ids}):
+            stack.enter_context(self._stock_locks[stripe])
+        return stack
+
+    def _product_changed(self, product: Product, name: str):
+        if name == 'discount_rules':
+            self.price_cache.invalidate_product(product.id)
+            return
+        if name == 'price':
+            self.price_cache.invalidate_product(product.id)
+        elif name in ('quantity', 'reorder_level'):
+            self.low_stock.update(product)
+        # Always take the lock: a rebuild in progress holds it, and may have
+        # read the old value already, so this update has to wait and land
+        # on the new columns
+        with self._columns_lock:
+            if self._columns is not None:
+                self._columns.update(product, name)
+
+    def _drop_columns(self):
+        with self._columns_lock:
+            self._columns = None
+
+    # Pricing
+    @instrumented('quote')
+    def quote(self, product_id: str, quantity: int = 1) -> float:
+        price = self.price_cache.get(product_id, quantity)
+        if price is None:
+            generation = self.price_cache.generation(product_id)
+            price = self.products[product_id].get_price(quantity)
+            self.price_cache.put(product_id, quantity, price, generation)
+        return price
+
+    @instrumented('quote_many')
+    def quote_many(self, product_ids, quantities) -> List[float]:
+        if len(product_ids) != len(quantities):
+            raise ValueError("product_ids and quantities must have the same length")
+        if not len(product_ids):
+            return []
+        # Quantities are whole units; anything else is rejected rather than
+        # truncated, so both paths agree with get_price on every valid input
+        if np is None:
+            if any(quantity < 0 or int(quantity) != quantity for quantity in quantities):
+                raise ValueError("Quantities must be non-negative integers")
+            products = self.products
+            return [products[product_id].get_price(quantity)
+                    for product_id, quantity in zip(product_ids, quantities)]
+
+        # Resolve lines to catalog rows, price every line's subtotal at once,
+        # then apply each distinct rule set's tier table to its lines together
+        columns = self.catalog_columns()
+        row_of = columns._rows
+        rows = np.fromiter((row_of[product_id] for product_id in product_ids),
+                           dtype=np.intp, count=len(product_ids))
+        requested = np.asarray(quantities)
+        quantities = requested.astype(np.int64)
+        if (quantities < 0).any() or not np.array_equal(quantities, requested):
+            raise ValueError("Quantities must be non-negative integers")
+        subtotals = columns.price[rows] * quantities
+
+        tables = []
+        table_codes = {}
+        row_codes = np.zeros(len(columns.ids), dtype=np.intp)
+        for row in np.flatnonzero(np.bincount(rows, minlength=len(columns.ids))).tolist():
+            table = self.products[columns.ids[row]]._pricing_table()
+            code = table_codes.get(table)
+            if code is None:
+                code = table_codes[table] = len(tables)
+                tables.append(table)
+            row_codes[row] = code
+
+        if len(tables) == 1:
+            return tables[0].discount_many(subtotals, quantities).tolist()
+        line_codes = row_codes[rows]
+        order = np.argsort(line_codes, kind='stable')
+        bounds = np.flatnonzero(np.diff(line_codes[order])) + 1
+        prices = np.empty_like(subtotals)
+        for lines in np.split(order, bounds):
+            table = tables[line_codes[lines[0]]]
+            prices[lines] = table.discount_many(subtotals[lines], quantities[lines])
+        return prices.tolist()
+
+    def low_stock_products(self, limit: Optional[int] = None) -> List[Product]:
+        # Most urgent first; O(k) in the number returned
+        products = self.products
+        return [products[product_id] for product_id in self.low_stock.ids(limit)
+                if product_id in products]
+
+    def catalog_columns(self) -> CatalogColumns:
+        columns = self._columns
+        if columns is None or len(columns.ids) != len(self.products):
+            with self._columns_lock:
+                if self._columns is None or len(self._columns.ids) != len(self.products):
+                    self._columns = CatalogColumns(self.products)
+                columns = self._columns
+        return columns
+
+    def adjust_stock(self, product_id: str, delta: int) -> int:
+        with self._stock_lock(product_id):
+            product = self.products[product_id]
+            # Stock held by open reservations cannot be taken
+            if delta < 0 and product.quantity + delta < self.reservations.held.get(product_id, 0):
+                raise ValueError(f"Insufficient stock for {product_id}")
+            product.quantity += delta
+            quantity = product.quantity
+        # Persists whatever the quantity is by the time the writer lock is
+        # free, so the last write always carries the latest value
+        self._persist('products', product_id)
+        return quantity
+
+    def add_customer(self, customer: 'Customer'):
+        with self._lock:
+            self.customers = {**self.customers, customer.id: customer}
+            self._persist('customers', customer.id)
+
+    def add_user(self, user: User):
+        with self._lock:
+            self.users = {**self.users, user.username: user}
+            self._persist('users', user.username)
+
+    @instrumented('authenticate')
     def authenticate_user(self, username: str, password: str) -> Optional[User]:
         user = self.users.get(username)
         if user and user.verify_password(password):
             return user
+        if METRICS.enabled:
+            METRICS.inc('authentication_failures_total')
         return None
 
+    def login(self, username: str, password: str) -> Optional[str]:
+        user = self.authenticate_user(username, password)
+        if user is None:
+            return None
+        return self.sessions.create(user.username)
+
+    def user_for_token(self, token: str) -> Optional[User]:
+        username = self.sessions.get_username(token)
+        if username is None:
+            return None
+        return self.users.get(username)
+
+    def logout(self, token: str) -> bool:
+        return self.sessions.revoke(token)
+
     def check_permission(self, user: User, permission: str) -> bool:
-        if "all" in Role.get_permissions(user.role):
-            return True
-        return permission in Role.get_permissions(user.role)
-
-    def export_inventory_report(self, format: str = 'csv'):
-        data = [{
-            'id': p.id,
-            'name': p.name,
-            'quantity': p.quantity,
-            'price': p.price,
-            'category': p.category.value
-        } for p in self.products.values()]
-        
-        if format == 'csv':
-            DataExporter.to_csv(data, 'inventory_report.csv')
-        elif format == 'pdf':
-            content = self.generate_inventory_report()
-            DataExporter.to_pdf('Inventory Report', content, 'inventory_report.pdf')
+        return permission in user.permissions
 
-    def generate_product_performance_report(self) -> str:
-        report = "Product Performance Report\n" + "="*30 + "\n\n"
-        
-        product_sales = {}
-        product_revenue = {}
-        
-        # Calculate sales and revenue by product
-        for invoice in self.invoices.values():
-            if invoice.status == InvoiceStatus.PAID:
-                for item in invoice.items:
-                    if item.product_id not in product_sales:
-                        product_sales[item.product_id] = 0
-                        product_revenue[item.product_id] = 0
-                    product_sales[item.product_id] += item.quantity
-                    product_revenue[item.product_id] += item.total
-
-        # Generate report
-        for product_id in product_sales:
-            product = self.products[product_id]
-            report += f"\nProduct: {product.name}\n"
-            report += f"Total Units Sold: {product_sales[product_id]}\n"
-            report += f"Total Revenue: ${product_revenue[product_id]:.2f}\n"
-            report += f"Current Stock: {product.quantity}\n"
-            if product.quantity <= product.reorder_level:
-                report += "WARNING: Stock below reorder level\n"
+    # Invoice lifecycle
+    @instrumented('add_invoice')
+    def add_invoice(self, invoice: 'Invoice'):
+        with self._lock:
+            previous = self.invoices.get(invoice.id)
+            if previous is not None:
+                self._detach_invoice(previous)
+            self.invoices[invoice.id] = invoice
+            self._attach_invoice(invoice)
+            self._persist('invoices', invoice.id)
 
-        return report
+    def set_invoice_status(self, invoice_id: str, status: 'InvoiceStatus') -> 'Invoice':
+        with self._lock:
+            invoice = self.invoices[invoice_id]
+            self._detach_invoice(invoice)
+            invoice.status = status
+            self._attach_invoice(invoice)
+            self._persist('invoices', invoice_id)
+            return invoice
 
-    def generate_customer_analysis_report(self) -> str:
-        report = "Customer Analysis Report\n" + "="*30 + "\n\n"
-        
-        customer_purchases = {}
-        
-        # Calculate purchases by customer
+    def modify_invoice(self, invoice_id: str, **changes) -> 'Invoice':
+        with self._lock:
+            invoice = self.invoices[invoice_id]
+            for name in changes:
+                if name not in _INVOICE_MUTABLE_FIELDS:
+                    raise ValueError(f"Cannot modify invoice field: {name}")
+            # The aggregates must be re-attached even if a change fails
+            # part-way; the old values come back first so they stay consistent
+            previous = {name: getattr(invoice, name) for name in changes}
+            self._detach_invoice(invoice)
+            try:
+                for name, value in changes.items():
+                    setattr(invoice, name, value)
+            except BaseException:
+                for name, value in previous.items():
+                    setattr(invoice, name, value)
+                raise
+            finally:
+                self._attach_invoice(invoice)
+            self._persist('invoices', invoice_id)
+            return invoice
+
+    @instrumented('create_invoice')
+    def create_invoice(self, invoice_id: str, customer_id: str, lines: Iterable[Tuple[str, int]],
+                       status: 'InvoiceStatus', date: Optional[str] = None,
+                       tax_rate: float = 0.0) -> 'Invoice':
+        # Reserve every line first so a short line rejects the whole order
+        # before any stock moves, then record the invoice and take the stock.
+        # The duplicate check and the insert happen together under the writer
+        # lock, so of two concurrent orders with one id only one gets stock.
+        # The hold never expires, so another thread's expire() cannot reap it
+        # between recording the invoice and committing.
+        if customer_id not in self.customers:
+            raise ValueError(f"Unknown customer: {customer_id}")
+        if invoice_id in self.invoices:
+            raise ValueError(f"Invoice {invoice_id} already exists")
+        reservation = self.reservations.reserve(lines, ttl=math.inf)
+        try:
+            items = [InvoiceItem(product_id, quantity, self.quote(product_id, quantity) / quantity)
+                     for product_id, quantity in reservation.lines.items()]
+            invoice = Invoice(invoice_id, customer_id, date or datetime.date.today().isoformat(),
+                              status, items, tax_rate)
+            with self._lock:
+                if invoice_id in self.invoices:
+                    raise ValueError(f"Invoice {invoice_id} already exists")
+                self.add_invoice(invoice)
+        except BaseException:
+            self.reservations.release(reservation.id)
+            raise
+        # Committing takes stock stripes, so it runs after the writer lock is
+        # released (lock order is stripe -> writer)
+        try:
+            self.reservations.commit(reservation.id)
+        except BaseException:
+            with self._lock:
+                self._detach_invoice(invoice)
+                del self.invoices[invoice_id]
+                self._persist('invoices', invoice_id)
+            raise
+        return invoice
+
+    # Every change to an invoice goes detach -> mutate -> attach so that the
+    # aggregates and indexes below never see a half-applied invoice
+    def _attach_invoice(self, invoice: 'Invoice'):
+        if invoice.status == InvoiceStatus.PAID:
+            self._apply_paid_invoice(invoice, 1)
+        self._index_invoice(invoice)
+
+    def _detach_invoice(self, invoice: 'Invoice'):
+        if invoice.status == InvoiceStatus.PAID:
+            self._apply_paid_invoice(invoice, -1)
+        self._unindex_invoice(invoice)
+
+    # Sales aggregates, kept in step with invoices entering or leaving PAID
+    # (paid, refunded, voided). Deltas are computed before anything is
+    # touched so a malformed invoice leaves the aggregates unchanged.
+    def _apply_paid_invoice(self, invoice: 'Invoice', sign: int):
+        if not self._aggregates_ready:
+            # The first rebuild will include this change
+            return
+        lines = [(item.product_id, item.quantity, item.total) for item in invoice.items]
+        items_bought = sum(quantity for _, quantity, _ in lines)
+        spent = invoice.total
+
+        for product_id, quantity, total in lines:
+            totals = self._product_totals.get(product_id)
+            if totals is None:
+                totals = self._product_totals[product_id] = [0, 0.0, 0]
+            totals[0] += sign * quantity
+            totals[1] += sign * total
+            totals[2] += sign
+            if totals[2] == 0:
+                del self._product_totals[product_id]
+
+        stats = self._customer_stats.get(invoice.customer_id)
+        if stats is None:
+            stats = self._customer_stats[invoice.customer_id] = {
+                'total_spent': 0,
+                'total_invoices': 0,
+                'items_bought': 0
+            }
+        stats['total_spent'] += sign * spent
+        stats['total_invoices'] += sign
+        stats['items_bought'] += sign * items_bought
+        if stats['total_invoices'] == 0:
+            del self._customer_stats[invoice.customer_id]
+
+    def _scan_sales_aggregates(self) -> Tuple[Dict[str, list], Dict[str, dict]]:
+        product_totals = {}
+        customer_stats = {}
         for invoice in self.invoices.values():
             if invoice.status == InvoiceStatus.PAID:
-                if invoice.customer_id not in customer_purchases:
-                    customer_purchases[invoice.customer_id] = {
-                        'total_spent': 0,
-                        'total_invoices': 0,
-                        'items_bought': 0
-                    }
-                
-                stats = customer_purchases[invoice.customer_id]
+                for item in invoice.items:
+                    totals = product_totals.setdefault(item.product_id, [0, 0.0, 0])
+                    totals[0] += item.quantity
+                    totals[1] += item.total
+                    totals[2] += 1
+
+                stats = customer_stats.setdefault(invoice.customer_id, {
+                    'total_spent': 0,
+                    'total_invoices': 0,
+                    'items_bought': 0
+                })
                 stats['total_spent'] += invoice.total
                 stats['total_invoices'] += 1
                 stats['items_bought'] += sum(item.quantity for item in invoice.items)
+        return product_totals, customer_stats
+
+    def _rebuild_sales_aggregates(self):
+        with self._lock:
+            if isinstance(self.storage, SqliteStorage):
+                aggregates = self.storage.sales_aggregates(InvoiceStatus.PAID.value)
+            else:
+                aggregates = self._scan_sales_aggregates()
+            self._product_totals, self._customer_stats = aggregates
+            self._aggregates_ready = True
+
+    def _ensure_sales_aggregates(self):
+        if not self._aggregates_ready:
+            with self._lock:
+                if not self._aggregates_ready:
+                    self._rebuild_sales_aggregates()
+
+    def _sales_aggregates_copy(self) -> Tuple[Dict[str, list], Dict[str, dict]]:
+        # Consistent copies for readers that iterate outside the lock
+        with self._lock:
+            self._ensure_sales_aggregates()
+            return ({product_id: list(totals) for product_id, totals in self._product_totals.items()},
+                    {customer_id: dict(stats) for customer_id, stats in self._customer_stats.items()})
+
+    def verify_sales_aggregates(self) -> bool:
+        actual_products, actual_customers = self._sales_aggregates_copy()
+        with self._lock:
+            expected_products, expected_customers = self._scan_sales_aggregates()
+        if expected_products.keys() != actual_products.keys():
+            return False
+        if expected_customers.keys() != actual_customers.keys():
+            return False
+        for product_id, (units, revenue, lines) in expected_products.items():
+            actual = actual_products[product_id]
+            if actual[0] != units or actual[2] != lines:
+                return False
+            if not math.isclose(actual[1], revenue, rel_tol=1e-9, abs_tol=1e-6):
+                return False
+        for customer_id, stats in expected_customers.items():
+            actual = actual_customers[customer_id]
+            if actual['total_invoices'] != stats['total_invoices']:
+                return False
+            if actual['items_bought'] != stats['items_bought']:
+                return False
+            if not math.isclose(actual['total_spent'], stats['total_spent'],
+                                rel_tol=1e-9, abs_tol=1e-6):
+                return False
+        return True
+
+    # Invoice indexes: range queries by date in O(log n + k), lookups by
+    # customer, product and status without scanning every invoice
+    def _ensure_invoice_indexes(self):
+        if self._invoice_dates is not None:
+            return
+        with self._lock:
+            if self._invoice_dates is None:
+                self._build_invoice_indexes()
+
+    def _build_invoice_indexes(self):
+        self._invoice_dates = []
+        self._invoice_date_ids = []
+        self._invoices_by_customer = {}
+        self._invoices_by_product = {}
+        self._invoices_by_status = {}
+        entries = []
+        for invoice in self.invoices.values():
+            entries.append((_date_key(invoice.date), invoice.id))
+            self._index_invoice_keys(invoice)
+        entries.sort()
+        self._invoice_dates = [date for date, _ in entries]
+        self._invoice_date_ids = [invoice_id for _, invoice_id in entries]
+
+    def _index_invoice_keys(self, invoice: 'Invoice'):
+        self._invoices_by_customer.setdefault(invoice.customer_id, set()).add(invoice.id)
+        self._invoices_by_status.setdefault(invoice.status, set()).add(invoice.id)
+        for item in invoice.items:
+            self._invoices_by_product.setdefault(item.product_id, set()).add(invoice.id)
+
+    def _index_invoice(self, invoice: 'Invoice'):
+        if self._invoice_dates is None:
+            return
+        # Same order as the full build and SQLite: by date, then by id
+        date = _date_key(invoice.date)
+        start = bisect.bisect_left(self._invoice_dates, date)
+        end = bisect.bisect_right(self._invoice_dates, date, start)
+        position = bisect.bisect_left(self._invoice_date_ids, invoice.id, start, end)
+        self._invoice_dates.insert(position, date)
+        self._invoice_date_ids.insert(position, invoice.id)
+        self._index_invoice_keys(invoice)
+
+    def _unindex_invoice(self, invoice: 'Invoice'):
+        if self._invoice_dates is None:
+            return
+        date = _date_key(invoice.date)
+        start = bisect.bisect_left(self._invoice_dates, date)
+        end = bisect.bisect_right(self._invoice_dates, date, start)
+        position = bisect.bisect_left(self._invoice_date_ids, invoice.id, start, end)
+        if position < end and self._invoice_date_ids[position] == invoice.id:
+            del self._invoice_dates[position]
+            del self._invoice_date_ids[position]
+        keys = [(self._invoices_by_customer, invoice.customer_id),
+                (self._invoices_by_status, invoice.status)]
+        keys.extend((self._invoices_by_product, item.product_id) for item in invoice.items)
+        for index, key in keys:
+            invoice_ids = index.get(key)
+            if invoice_ids is not None:
+                invoice_ids.discard(invoice.id)
+                if not invoice_ids:
+                    del index[key]
+
+    def _sorted_invoices(self, invoice_ids) -> List['Invoice']:
+        with self._lock:
+            invoices = [self.invoices[invoice_id] for invoice_id in invoice_ids]
+        invoices.sort(key=lambda invoice: (_date_key(invoice.date), invoice.id))
+        return invoices
+
+    def _indexed_ids(self, index_name: str, key) -> List[str]:
+        self._ensure_invoice_indexes()
+        with self._lock:
+            return list(getattr(self, index_name).get(key, ()))
+
+    def _stored_invoices(self, **filters) -> Optional[List['Invoice']]:
+        # On SQLite, until the in-memory indexes exist, answer lookups with an
+        # indexed query and fetch just the matching records rather than
+        # materializing every invoice to build the indexes
+        if not isinstance(self.storage, SqliteStorage) or self._invoice_dates is not None:
+            return None
+        with self._lock:
+            return [self.invoices[invoice_id]
+                    for invoice_id in self.storage.find_invoice_ids(**filters)]
+
+    def invoices_for_customer(self, customer_id: str,
+                              status: Optional['InvoiceStatus'] = None) -> List['Invoice']:
+        stored = self._stored_invoices(customer_id=customer_id,
+                                       status=status.value if status is not None else None)
+        if stored is not None:
+            return stored
+        self._ensure_invoice_indexes()
+        with self._lock:
+            invoice_ids = self._invoices_by_customer.get(customer_id, set())
+            if status is not None:
+                invoice_ids = invoice_ids & self._invoices_by_status.get(status, set())
+            invoice_ids = list(invoice_ids)
+        return self._sorted_invoices(invoice_ids)
+
+    def invoices_with_status(self, status: 'InvoiceStatus') -> List['Invoice']:
+        stored = self._stored_invoices(status=status.value)
+        if stored is not None:
+            return stored
+        return self._sorted_invoices(self._indexed_ids('_invoices_by_status', status))
+
+    def invoice_items_for_product(self, product_id: str) -> List[Tuple['Invoice', 'InvoiceItem']]:
+        invoices = self._stored_invoices(product_id=product_id)
+        if invoices is None:
+            invoices = self._sorted_invoices(self._indexed_ids('_invoices_by_product', product_id))
+        return [(invoice, item)
+                for invoice in invoices
+                for item in invoice.items if item.product_id == product_id]
+
+    def invoices_between(self, start_date: Optional[str] = None,
+                         end_date: Optional[str] = None) -> List['Invoice']:
+        # Both bounds inclusive; a missing or blank bound leaves that end open
+        stored = self._stored_invoices(start_date=start_date, end_date=end_date)
+        if stored is not None:
+            return stored
+        self._ensure_invoice_indexes()
+        with self._lock:
+            start = (bisect.bisect_left(self._invoice_dates, _date_key(start_date))
+                     if start_date else 0)
+            end = (bisect.bisect_right(self._invoice_dates, _date_key(end_date))
+                   if end_date else len(self._invoice_dates))
+            return [self.invoices[invoice_id] for invoice_id in self._invoice_date_ids[start:end]]
+
+    def sales_by_period(self, period: str = 'month', start_date: Optional[str] = None,
+                        end_date: Optional[str] = None) -> Dict[str, dict]:
+        if period not in ('month', 'quarter'):
+            raise ValueError(f"Unknown period: {period}")
+        buckets = {}
+        for invoice in self.invoices_between(start_date, end_date):
+            if invoice.status != InvoiceStatus.PAID:
+                continue
+            bucket = _period_bucket(_date_key(invoice.date), period)
+            stats = buckets.setdefault(bucket, {'invoices': 0, 'revenue': 0.0})
+            stats['invoices'] += 1
+            stats['revenue'] += invoice.total
+        return buckets
+
+    @instrumented('report', report='sales')
+    def iter_sales_report(self, start_date: Optional[str] = None,
+                          end_date: Optional[str] = None,
+                          period: Optional[str] = None) -> Iterator[str]:
+        if period not in (None, 'month', 'quarter'):
+            raise ValueError(f"Unknown period: {period}")
+        yield f"Sales Report ({start_date or 'beginning'} to {end_date or 'latest'})\n"
+        yield "="*30 + "\n\n"
+
+        total_invoices = 0
+        total_revenue = 0.0
+        buckets = {}
+        for invoice in self.invoices_between(start_date, end_date):
+            if invoice.status != InvoiceStatus.PAID:
+                continue
+            customer = self.customers.get(invoice.customer_id)
+            customer_name = customer.name if customer else invoice.customer_id
+            date = _date_key(invoice.date)
+            yield f"{date}  Invoice {invoice.id}  {customer_name}  ${invoice.total:.2f}\n"
+            total_invoices += 1
+            total_revenue += invoice.total
+            if period:
+                stats = buckets.setdefault(_period_bucket(date, period), {'invoices': 0, 'revenue': 0.0})
+                stats['invoices'] += 1
+                stats['revenue'] += invoice.total
+
+        if period:
+            yield f"\nSales by {period}:\n"
+            for bucket, stats in buckets.items():
+                yield f"{bucket}: {stats['invoices']} invoices, ${stats['revenue']:.2f}\n"
+
+        yield f"\nTotal Invoices: {total_invoices}\n"
+        yield f"Total Revenue: ${total_revenue:.2f}\n"
+
+    def generate_sales_report(self, start_date: Optional[str] = None,
+                              end_date: Optional[str] = None,
+                              period: Optional[str] = None) -> str:
+        return "".join(self.iter_sales_report(start_date, end_date, period))
+
+    @instrumented('export', export='inventory')
+    def export_inventory_report(self, format: str = 'csv', compress: bool = False):
+        if format == 'csv':
+            data = ({
+                'id': p.id,
+                'name': p.name,
+                'quantity': p.quantity,
+                'price': p.price,
+                'category': p.category.value
+            } for p in self.products.values())
+            filename = 'inventory_report.csv.gz' if compress else 'inventory_report.csv'
+            DataExporter.to_csv(data, filename,
+                                fieldnames=['id', 'name', 'quantity', 'price', 'category'],
+                                compress=compress)
+        elif format == 'pdf':
+            DataExporter.to_pdf('Inventory Report', self.iter_inventory_report(),
+                                'inventory_report.pdf')
+
+    def iter_invoice_lines(self, invoice: 'Invoice') -> Iterator[str]:
+        customer = self.customers.get(invoice.customer_id)
+        yield f"Invoice: {invoice.id}\n"
+        yield f"Date: {_date_key(invoice.date)}\n"
+        yield f"Customer: {customer.name if customer else invoice.customer_id}\n"
+        yield f"Status: {invoice.status.value}\n\n"
+        for item in invoice.items:
+            product = self.products.get(item.product_id)
+            name = product.name if product else item.product_id
+            yield f"{name} x{item.quantity} @ ${item.unit_price:.2f} = ${item.total:.2f}\n"
+        yield f"\nSubtotal: ${invoice.subtotal:.2f}\n"
+        yield f"Tax: ${invoice.total - invoice.subtotal:.2f}\n"
+        yield f"Total: ${invoice.total:.2f}\n"
+
+    def format_invoice(self, invoice: 'Invoice') -> str:
+        return "".join(self.iter_invoice_lines(invoice))
+
+    def iter_customer_statement(self, customer_id: str, start_date: Optional[str] = None,
+                                end_date: Optional[str] = None) -> Iterator[str]:
+        customer = self.customers.get(customer_id)
+        if customer is None:
+            raise ValueError(f"Unknown customer: {customer_id}")
+        yield f"Customer: {customer.name}\n"
+        yield f"Period: {start_date or 'beginning'} to {end_date or 'latest'}\n\n"
+        unpaid = 0.0
+        for invoice in self.invoices_for_customer(customer_id):
+            date = _date_key(invoice.date)
+            if (start_date and date < _date_key(start_date)) or (end_date and date > _date_key(end_date)):
+                continue
+            yield f"{date}  Invoice {invoice.id}  {invoice.status.value}  ${invoice.total:.2f}\n"
+            if invoice.status != InvoiceStatus.PAID:
+                unpaid += invoice.total
+        yield f"\nTotal Unpaid: ${unpaid:.2f}\n"
+
+    def format_customer_statement(self, customer_id: str, start_date: Optional[str] = None,
+                                  end_date: Optional[str] = None) -> str:
+        return "".join(self.iter_customer_statement(customer_id, start_date, end_date))
+
+    def _format_invoice_by_id(self, invoice_id: str) -> str:
+        invoice = self.invoices.get(invoice_id)
+        if invoice is None:
+            raise ValueError(f"Unknown invoice: {invoice_id}")
+        return self.format_invoice(invoice)
+
+    @instrumented('export', export='invoice_pdfs')
+    def export_invoice_pdfs(self, output_dir: str, invoice_ids: Optional[Iterable[str]] = None,
+                            workers: Optional[int] = None,
+                            progress: Optional[Callable[[int, str, Optional[str]], None]] = None
+                            ) -> Tuple[List[str], Dict[str, str]]:
+        if invoice_ids is None:
+            with self._lock:
+                invoice_ids = list(self.invoices)
+        # Content is formatted per document inside to_pdf_batch, so an
+        # unknown id is reported in failures instead of aborting the batch
+        documents = ((f"Invoice {invoice_id}",
+                      functools.partial(self._format_invoice_by_id, invoice_id),
+                      f"invoice_{invoice_id}.pdf") for invoice_id in invoice_ids)
+        return DataExporter.to_pdf_batch(documents, output_dir, workers, progress=progress)
+
+    @instrumented('export', export='customer_statements')
+    def export_customer_statements(self, output_dir: str, start_date: Optional[str] = None,
+                                   end_date: Optional[str] = None,
+                                   customer_ids: Optional[Iterable[str]] = None,
+                                   workers: Optional[int] = None,
+                                   progress: Optional[Callable[[int, str, Optional[str]], None]] = None
+                                   ) -> Tuple[List[str], Dict[str, str]]:
+        if customer_ids is None:
+            customer_ids = list(self.customers)
+        documents = (("Customer Statement",
+                      functools.partial(self.format_customer_statement,
+                                        customer_id, start_date, end_date),
+                      f"statement_{customer_id}.pdf") for customer_id in customer_ids)
+        return DataExporter.to_pdf_batch(documents, output_dir, workers, progress=progress)
+
+    # Reports are produced line by line; generate_* joins them for callers
+    # that want a string, write_report streams them to any file-like object
+    @instrumented('report', report='inventory')
+    def iter_inventory_report(self) -> Iterator[str]:
+        yield "Inventory Report\n" + "="*30 + "\n"
+
+        by_category = {}
+        for product in self.products.values():
+            by_category.setdefault(product.category, []).append(product)
+        for category, products in by_category.items():
+            yield f"\nCategory: {category.value}\n"
+            for product in products:
+                line = f"{product.id}  {product.name}  Qty: {product.quantity}  ${product.price:.2f}"
+                if product.quantity <= product.reorder_level:
+                    line += "  WARNING: Stock below reorder level"
+                yield line + "\n"
+
+        columns = self.catalog_columns()
+        yield "\nStock Value by Category:\n"
+        for category, value in columns.value_by_category().items():
+            yield f"{category.value}: ${value:.2f}\n"
+        yield f"\nTotal Stock Value: ${columns.total_stock_value():.2f}\n"
+        yield f"Products Below Reorder Level: {len(self.low_stock)}\n"
+
+    def generate_inventory_report(self) -> str:
+        return "".join(self.iter_inventory_report())
+
+    @instrumented('report', report='product_performance')
+    def iter_product_performance_report(self) -> Iterator[str]:
+        yield "Product Performance Report\n" + "="*30 + "\n\n"
 
-        # Generate report
-        for customer_id, stats in customer_purchases.items():
+        product_totals, _ = self._sales_aggregates_copy()
+        # Generate report from the running totals
+        for product_id, (units, revenue, _) in product_totals.items():
+            product = self.products[product_id]
+            yield f"\nProduct: {product.name}\n"
+            yield f"Total Units Sold: {units}\n"
+            yield f"Total Revenue: ${revenue:.2f}\n"
+            yield f"Current Stock: {product.quantity}\n"
+            if product.quantity <= product.reorder_level:
+                yield "WARNING: Stock below reorder level\n"
+
+    def generate_product_performance_report(self) -> str:
+        return "".join(self.iter_product_performance_report())
+
+    @instrumented('report', report='customer_analysis')
+    def iter_customer_analysis_report(self) -> Iterator[str]:
+        yield "Customer Analysis Report\n" + "="*30 + "\n\n"
+
+        _, customer_stats = self._sales_aggregates_copy()
+        # Generate report from the running per-customer aggregates
+        for customer_id, stats in customer_stats.items():
             customer = self.customers[customer_id]
-            report += f"\nCustomer: {customer.name}\n"
-            report += f"Total Spent: ${stats['total_spent']:.2f}\n"
-            report += f"Number of Invoices: {stats['total_invoices']}\n"
-            report += f"Total Items Bought: {stats['items_bought']}\n"
-            report += f"Average Order Value: ${stats['total_spent']/stats['total_invoices']:.2f}\n"
+            yield f"\nCustomer: {customer.name}\n"
+            yield f"Total Spent: ${stats['total_spent']:.2f}\n"
+            yield f"Number of Invoices: {stats['total_invoices']}\n"
+            yield f"Total Items Bought: {stats['items_bought']}\n"
+            yield f"Average Order Value: ${stats['total_spent']/stats['total_invoices']:.2f}\n"
+
+    def generate_customer_analysis_report(self) -> str:
+        return "".join(self.iter_customer_analysis_report())
+
+    _REPORTS = {
+        'inventory': 'iter_inventory_report',
+        'sales': 'iter_sales_report',
+        'product_performance': 'iter_product_performance_report',
+        'customer_analysis': 'iter_customer_analysis_report'
+    }
+
+    def iter_report(self, name: str, *args, **kwargs) -> Iterator[str]:
+        if name not in self._REPORTS:
+            raise ValueError(f"Unknown report: {name}")
+        return getattr(self, self._REPORTS[name])(*args, **kwargs)
+
+    def write_report(self, name: str, stream, *args, **kwargs):
+        stream.writelines(self.iter_report(name, *args, **kwargs))
+
+    def render_metrics(self) -> str:
+        # Point-in-time gauges for this system, then the whole registry
+        if METRICS.enabled:
+            METRICS.set_gauge('products', len(self.products))
+            METRICS.set_gauge('customers', len(self.customers))
+            METRICS.set_gauge('sessions', len(self.sessions))
+            METRICS.set_gauge('reservations', len(self.reservations))
+            METRICS.set_gauge('low_stock_products', len(self.low_stock))
+            for name, value in self.price_cache.stats().items():
+                METRICS.set_gauge(f"price_cache_{name}", value)
+        return METRICS.render()
+
+# HTTP/JSON API
+class HttpError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+class LatencyStats:
+    # Per-route request count, total/max latency and percentiles over the
+    # most recent `window` samples
+    def __init__(self, window: int = 1024):
+        self.window = window
+        self._routes: Dict[str, dict] = {}
+
+    def record(self, route: str, seconds: float):
+        stats = self._routes.get(route)
+        if stats is None:
+            stats = self._routes[route] = {
+                'count': 0, 'total': 0.0, 'max': 0.0, 'recent': deque(maxlen=self.window)}
+        stats['count'] += 1
+        stats['total'] += seconds
+        stats['max'] = max(stats['max'], seconds)
+        stats['recent'].append(seconds)
+
+    def summary(self) -> Dict[str, dict]:
+        summary = {}
+        for route, stats in self._routes.items():
+            recent = sorted(stats['recent'])
+            summary[route] = {
+                'count': stats['count'],
+                'mean_ms': stats['total'] / stats['count'] * 1000,
+                'max_ms': stats['max'] * 1000,
+                'p50_ms': statistics.median(recent) * 1000,
+                'p99_ms': recent[min(len(recent) - 1, int(len(recent) * 0.99))] * 1000
+            }
+        return summary
+
+class ApiServer:
+    # Minimal asyncio HTTP/1.1 server (keep-alive, JSON bodies) in front of
+    # an InventorySystem. Product and customer lookups run on the event loop;
+    # invoice lookups (which may hit storage), reports and PDF exports run on
+    # a thread pool (PDF rendering itself fans out to processes) so slow
+    # requests never block other clients. Every request except POST /login
+    # and GET /metrics needs an "Authorization: Bearer <token>" header.
+    # Exports are written only below export_root and are disabled without it.
+    max_body = 1 << 20
+
+    def __init__(self, system: 'InventorySystem', host: str = '127.0.0.1', port: int = 8080,
+                 workers: int = 4, export_root: Optional[str] = None):
+        self.system = system
+        self.host = host
+        self.port = port
+        self.export_root = export_root
+        self.latency = LatencyStats()
+        self._executor = concurrent.futures.ThreadPoolExecutor(workers)
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def serve_forever(self):
+        if self._server is None:
+            await self.start()
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        self._executor.shutdown(wait=False)
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                started = time.perf_counter()
+                keep_alive, route = await self._handle_request(request_line, reader, writer, started)
+                elapsed = time.perf_counter() - started
+                self.latency.record(route, elapsed)
+                if METRICS.enabled:
+                    METRICS.observe('http_request_seconds', elapsed, route=route)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def _handle_request(self, request_line: bytes, reader: asyncio.StreamReader,
+                              writer: asyncio.StreamWriter, started: float) -> Tuple[bool, str]:
+        parts = request_line.decode('latin-1').split()
+        if len(parts) != 3:
+            await self._respond(writer, 400, {'error': "Malformed request line"}, False, started)
+            return False, "invalid"
+        method, target, version = parts
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        keep_alive = (headers.get('connection', '').lower() != 'close'
+                      and version == 'HTTP/1.1')
+
+        url = urlsplit(target)
+        path = [part for part in url.path.split('/') if part]
+        route = f"{method} /{path[0] if path else ''}" + ("/{id}" if len(path) > 1 else "")
+        try:
+            try:
+                length = int(headers.get('content-length') or 0)
+            except ValueError:
+                length = -1
+            if length < 0:
+                # The body cannot be skipped, so the connection cannot be reused
+                keep_alive = False
+                raise HttpError(400, "Invalid Content-Length")
+            if length > self.max_body:
+                keep_alive = False
+                raise HttpError(413, "Request body too large")
+            body = await reader.readexactly(length) if length else b''
+            query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+            payload = json.loads(body) if body else {}
+            if not isinstance(payload, dict):
+                raise HttpError(400, "JSON body must be an object")
+            status, result = await self._dispatch(method, path, query, payload, headers)
+        except HttpError as e:
+            status, result = e.status, {'error': e.message}
+        except json.JSONDecodeError:
+            status, result = 400, {'error': "Invalid JSON body"}
+        except Exception:
+            # Details go to the server log, never to the client
+            traceback.print_exc()
+            status, result = 500, {'error': "Internal server error"}
+        await self._respond(writer, status, result, keep_alive, started)
+        return keep_alive, route
+
+    async def _respond(self, writer: asyncio.StreamWriter, status: int, result: object,
+                       keep_alive: bool, started: float):
+        if isinstance(result, str):
+            content_type, data = 'text/plain; charset=utf-8', result.encode()
+        else:
+            content_type, data = 'application/json', json.dumps(result, default=str).encode()
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        writer.write(
+            (f"HTTP/1.1 {status} {HTTPStatus(status).phrase}\r\n"
+             f"Content-Type: {content_type}\r\n"
+             f"Content-Length: {len(data)}\r\n"
+             f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n"
+             f"X-Response-Time: {elapsed_ms:.3f}ms\r\n\r\n").encode('latin-1') + data)
+        await writer.drain()
+
+    def _user(self, headers: dict, permission: str) -> User:
+        scheme, _, token = headers.get('authorization', '').partition(' ')
+        user = self.system.user_for_token(token) if scheme.lower() == 'bearer' else None
+        if user is None:
+            raise HttpError(401, "Authentication required")
+        if not self.system.check_permission(user, permission):
+            raise HttpError(403, "Permission denied")
+        return user
+
+    async def _offload(self, func: Callable, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    @staticmethod
+    def _int_param(query: dict, name: str, default: Optional[int]) -> Optional[int]:
+        if name not in query:
+            return default
+        try:
+            value = int(query[name])
+        except ValueError:
+            raise HttpError(400, f"{name} must be an integer")
+        if value < 0:
+            raise HttpError(400, f"{name} must not be negative")
+        return value
+
+    @staticmethod
+    def _status_param(query: dict) -> Optional['InvoiceStatus']:
+        if 'status' not in query:
+            return None
+        try:
+            return InvoiceStatus(query['status'])
+        except ValueError:
+            raise HttpError(400, f"Unknown invoice status: {query['status']}")
+
+    def _export_dir(self, output_dir: str) -> str:
+        if self.export_root is None:
+            raise HttpError(403, "Exports are disabled")
+        root = os.path.realpath(self.export_root)
+        target = os.path.realpath(os.path.join(root, output_dir))
+        if os.path.commonpath([root, target]) != root:
+            raise HttpError(400, "output_dir must be inside the export root")
+        return target
 
-        return report
+    def _page(self, query: dict) -> Callable[[Iterable], List]:
+        offset = self._int_param(query, 'offset', 0)
+        limit = self._int_param(query, 'limit', 100)
+        return lambda items: list(itertools.islice(items, offset, offset + limit))
+
+    async def _dispatch(self, method: str, path: List[str], query: dict, payload: dict,
+                        headers: dict) -> Tuple[int, object]:
+        system = self.system
+        resource = path[0] if path else ''
+
+        if (method, path) == ('POST', ['login']):
+            token = system.login(payload.get('username', ''), payload.get('password', ''))
+            if token is None:
+                raise HttpError(401, "Invalid credentials")
+            return 200, {'token': token}
+
+        if (method, path) == ('POST', ['logout']):
+            self._user(headers, 'read')
+            system.logout(headers['authorization'].partition(' ')[2])
+            return 200, {'ok': True}
+
+        if (method, path) == ('GET', ['metrics']):
+            # Unauthenticated, for Prometheus scrapers
+            if not METRICS.enabled:
+                raise HttpError(404, "Metrics are disabled")
+            return 200, system.render_metrics()
+
+        if (method, path) == ('GET', ['low-stock']):
+            self._user(headers, 'read')
+            limit = self._int_param(query, 'limit', None)
+            return 200, [{'id': product.id, 'name': product.name, 'quantity': product.quantity,
+                          'reorder_level': product.reorder_level}
+                         for product in system.low_stock_products(limit)]
+
+        if method == 'GET' and resource == 'stats' and len(path) == 1:
+            self._user(headers, 'view_reports')
+            return 200, self.latency.summary()
+
+        if method == 'GET' and resource in ('products', 'customers', 'invoices') and len(path) <= 2:
+            self._user(headers, 'read')
+            to_record = _COLLECTIONS[resource][0]
+            if len(path) == 2:
+                lookup = lambda: getattr(system, resource).get(path[1])
+                obj = await self._offload(lookup) if resource == 'invoices' else lookup()
+                if obj is None:
+                    raise HttpError(404, f"No such {resource[:-1]}: {path[1]}")
+                return 200, to_record(obj)
+            page = self._page(query)
+            if resource != 'invoices':
+                return 200, [to_record(obj) for obj in page(getattr(system, resource).values())]
+            status = self._status_param(query)
+            if 'customer_id' in query:
+                find = lambda: system.invoices_for_customer(query['customer_id'], status)
+            elif 'product_id' in query:
+                find = lambda: [invoice for invoice, _ in
+                                system.invoice_items_for_product(query['product_id'])]
+            elif status is not None:
+                find = lambda: system.invoices_with_status(status)
+            else:
+                find = lambda: system.invoices_between(query.get('start_date'), query.get('end_date'))
+            return 200, await self._offload(
+                lambda: [to_record(obj) for obj in page(find())])
+
+        if method == 'GET' and resource == 'reports' and len(path) == 2:
+            self._user(headers, 'view_reports')
+            name = path[1]
+            if name not in InventorySystem._REPORTS:
+                raise HttpError(404, f"No such report: {name}")
+            if query.get('period') not in (None, 'month', 'quarter'):
+                raise HttpError(400, f"Unknown period: {query['period']}")
+            args = ((query.get('start_date'), query.get('end_date'), query.get('period'))
+                    if name == 'sales' else ())
+            report = await self._offload(lambda: "".join(system.iter_report(name, *args)))
+            return 200, report
+
+        if method == 'POST' and resource == 'exports' and len(path) == 2:
+            self._user(headers, 'view_reports')
+            output_dir = payload.get('output_dir')
+            if not output_dir:
+                raise HttpError(400, "output_dir is required")
+            output_dir = self._export_dir(output_dir)
+            if path[1] == 'invoices':
+                export = lambda: system.export_invoice_pdfs(output_dir, payload.get('invoice_ids'))
+            elif path[1] == 'statements':
+                export = lambda: system.export_customer_statements(
+                    output_dir, payload.get('start_date'), payload.get('end_date'))
+            else:
+                raise HttpError(404, f"No such export: {path[1]}")
+            written, failures = await self._offload(export)
+            return 200, {'written': len(written), 'failures': failures}
+
+        raise HttpError(404, f"No route for {method} /{'/'.join(path)}")
+
+# Benchmarks
+def _bytes_per_record(factory: Callable[[int], object], count: int) -> float:
+    records = [None] * count
+    gc.collect()
+    tracemalloc.start()
+    for i in range(count):
+        records[i] = factory(i)
+    allocated, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return allocated / count
+
+def bench_memory(count: int = 100000) -> Dict[str, float]:
+    # The pre-slots layouts, kept here only as the "before" baseline
+    @dataclass
+    class DictProduct:
+        id: str
+        name: str
+        price: float
+        quantity: int
+        category: object
+        reorder_level: int = 10
+        discount_rules: list = None
+
+        def __post_init__(self):
+            if self.discount_rules is None:
+                self.discount_rules = []
+
+    @dataclass
+    class DictInvoiceItem:
+        product_id: str
+        quantity: int
+        unit_price: float
+        total: float
+
+    @dataclass
+    class DictInvoice:
+        id: str
+        customer_id: str
+        date: str
+        status: object
+        items: list
+        tax_rate: float = 0.0
+
+    category = next(iter(ProductCategory))
+    status = InvoiceStatus.PAID
+    results = {}
+    for name, before, after in (
+        ('product',
+         lambda i: DictProduct(f"P{i}", f"Product {i}", 9.99, i, category),
+         lambda i: Product(f"P{i}", f"Product {i}", 9.99, i, category)),
+        ('invoice_item',
+         lambda i: DictInvoiceItem(f"P{i}", 3, 9.99, 29.97),
+         lambda i: InvoiceItem(f"P{i}", 3, 9.99, 29.97)),
+        ('invoice',
+         lambda i: DictInvoice(f"INV{i}", f"C{i}", "2024-01-01", status, [], 0.1),
+         lambda i: Invoice(f"INV{i}", f"C{i}", "2024-01-01", status, [], 0.1)),
+    ):
+        results[f"{name}_bytes_before"] = _bytes_per_record(before, count)
+        results[f"{name}_bytes_after"] = _bytes_per_record(after, count)
+    return results
+
+def _reference_price(product: Product, quantity: int) -> float:
+    # The uncompiled per-rule loop, for comparison
+    price = product.price * quantity
+    for rule in product._discount_rules or ():
+        if isinstance(rule, BulkDiscount):
+            price = rule.apply(price, quantity)
+        else:
+            price = rule.apply(price)
+    return price
+
+def bench_pricing(count: int = 100000) -> Dict[str, float]:
+    rules = [PercentageDiscount(p) for p in (2, 3, 5)]
+    rules += [BulkDiscount(threshold, 1 + threshold % 7) for threshold in range(5, 100, 5)]
+    product = Product("P1", "Benchmark Product", 19.99, 1000, next(iter(ProductCategory)),
+                      discount_rules=rules)
+    quantities = [1 + i % 120 for i in range(count)]
+    for quantity in quantities[:120]:
+        if product.get_price(quantity) != _reference_price(product, quantity):
+            raise AssertionError(f"Compiled price differs at quantity {quantity}")
+
+    start = time.perf_counter()
+    for quantity in quantities:
+        _reference_price(product, quantity)
+    reference = time.perf_counter() - start
+    start = time.perf_counter()
+    for quantity in quantities:
+        product.get_price(quantity)
+    compiled = time.perf_counter() - start
+    return {
+        'rules': len(rules),
+        'rule_loop_quotes_per_sec': count / reference,
+        'compiled_quotes_per_sec': count / compiled,
+        'speedup': reference / compiled
+    }
+
+def bench_permissions(count: int = 1000000) -> Dict[str, float]:
+    system = InventorySystem.__new__(InventorySystem)
+    users = [User(f"user{i}", "password", role)
+             for i, role in enumerate((Role.ADMIN, Role.MANAGER, Role.STAFF))]
+    checks = [(users[i % 3], permission) for i, permission in
+              zip(range(count), itertools.cycle(("read", "write", "view_reports", "delete")))]
+
+    # The previous check: two role -> permissions dict rebuilds per call
+    def rebuild_permissions(role: str) -> set:
+        permissions = {
+            Role.ADMIN: {"all"},
+            Role.MANAGER: {"read", "write", "create_invoice", "view_reports"},
+            Role.STAFF: {"read", "create_invoice"}
+        }
+        return permissions.get(role, set())
+
+    def rebuilt_check(user: User, permission: str) -> bool:
+        if "all" in rebuild_permissions(user.role):
+            return True
+        return permission in rebuild_permissions(user.role)
 
-def main():
-    system = InventorySystem()
+    for user, permission in checks[:12]:
+        if rebuilt_check(user, permission) != system.check_permission(user, permission):
+            raise AssertionError(f"Permission mismatch for {user.role}/{permission}")
+
+    start = time.perf_counter()
+    for user, permission in checks:
+        rebuilt_check(user, permission)
+    rebuilt = time.perf_counter() - start
+    start = time.perf_counter()
+    for user, permission in checks:
+        system.check_permission(user, permission)
+    compiled = time.perf_counter() - start
+    return {
+        'rebuilt_checks_per_sec': count / rebuilt,
+        'compiled_checks_per_sec': count / compiled,
+        'speedup': rebuilt / compiled
+    }
+
+def _run_threads(targets: List[Callable[[], None]]) -> List[BaseException]:
+    errors = []
+
+    def guarded(target):
+        try:
+            target()
+        except BaseException as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=guarded, args=(target,)) for target in targets]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return errors
+
+def bench_concurrency(count: int = 100000, workers: int = 8) -> Dict[str, float]:
+    # Stress test: workers hammer a few hot products with stock changes
+    # while a reader walks catalog snapshots and a writer adds and removes
+    # products. Every accepted delta must be reflected in the final stock.
+    category = next(iter(ProductCategory))
+    hot = [f"HOT{i}" for i in range(4)]
+    per_worker = count // workers
+    switch_interval = sys.getswitchinterval()
+    # Switch threads far more often than usual to provoke interleavings
+    sys.setswitchinterval(1e-6)
+    directory = tempfile.mkdtemp()
+    try:
+        # The unsynchronized read-modify-write this replaces, as a baseline
+        unlocked = {product_id: Product(product_id, product_id, 1.0, 0, category)
+                    for product_id in hot}
+
+        def unlocked_worker(seed: int):
+            rng = random.Random(seed)
+            for _ in range(per_worker):
+                unlocked[rng.choice(hot)].quantity += 1
+
+        _run_threads([lambda seed=seed: unlocked_worker(seed) for seed in range(workers)])
+        unlocked_lost = per_worker * workers - sum(p.quantity for p in unlocked.values())
+
+        system = InventorySystem(os.path.join(directory, "bench.json"))
+        for product_id in hot:
+            system.add_product(Product(product_id, product_id, 1.0, 1000, category))
+        applied = [dict.fromkeys(hot, 0) for _ in range(workers)]
+        done = threading.Event()
+
+        def stock_worker(seed: int):
+            rng = random.Random(seed)
+            for _ in range(per_worker):
+                product_id = rng.choice(hot)
+                delta = rng.randint(-5, 5)
+                try:
+                    system.adjust_stock(product_id, delta)
+                except ValueError:
+                    continue
+                applied[seed][product_id] += delta
+
+        def stock_workers():
+            try:
+                _run_threads([lambda seed=seed: stock_worker(seed) for seed in range(workers)])
+            finally:
+                done.set()
+
+        def reader():
+            while not done.is_set():
+                products = system.snapshot()['products']
+                if any(product.quantity < 0 for product in products.values()):
+                    raise AssertionError("Negative stock observed")
+                "".join(system.iter_inventory_report())
+
+        def restructurer():
+            i = 0
+            while not done.is_set():
+                system.add_product(Product(f"TMP{i}", "Temporary", 1.0, 1, category))
+                system.remove_product(f"TMP{i}")
+                i += 1
+
+        start = time.perf_counter()
+        errors = _run_threads([stock_workers, reader, restructurer])
+        elapsed = time.perf_counter() - start
+        system.close()
+        if errors:
+            raise errors[0]
+
+        lost = 0
+        reloaded = InventorySystem(os.path.join(directory, "bench.json"))
+        for product_id in hot:
+            expected = 1000 + sum(deltas[product_id] for deltas in applied)
+            lost += abs(expected - system.products[product_id].quantity)
+            lost += abs(expected - reloaded.products[product_id].quantity)
+        reloaded.close()
+        if lost:
+            raise AssertionError(f"{lost} stock units lost under contention")
+    finally:
+        sys.setswitchinterval(switch_interval)
+        shutil.rmtree(directory, ignore_errors=True)
+    return {
+        'unlocked_lost_updates': unlocked_lost,
+        'lost_updates': lost,
+        'stock_updates_per_sec': per_worker * workers / elapsed
+    }
+
+def bench_reservations(count: int = 20000, workers: int = 16) -> Dict[str, float]:
+    # Flash-sale load test: many threads order the same few SKUs, some
+    # carts are abandoned and some left to time out. Stock sold must never
+    # exceed stock on hand and no hold may be left behind.
+    category = next(iter(ProductCategory))
+    hot = {f"HOT{i}": count // 8 for i in range(3)}
+    per_worker = count // workers
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    directory = tempfile.mkdtemp()
+    try:
+        system = InventorySystem(os.path.join(directory, "bench.json"))
+        system.add_customer(Customer("C1", "Load Test", "load@example.com", "", ""))
+        for product_id, stock in hot.items():
+            system.add_product(Product(product_id, product_id, 5.0, stock, category))
+        sold = [dict.fromkeys(hot, 0) for _ in range(workers)]
+        outcomes = [{'orders': 0, 'rejected': 0, 'abandoned': 0} for _ in range(workers)]
+
+        def shopper(seed: int):
+            rng = random.Random(seed)
+            counts = outcomes[seed]
+            for i in range(per_worker):
+                lines = [(product_id, rng.randint(1, 3))
+                         for product_id in rng.sample(sorted(hot), rng.randint(1, 2))]
+                roll = rng.random()
+                try:
+                    if roll < 0.1:
+                        system.reservations.release(system.reservations.reserve(lines).id)
+                        counts['abandoned'] += 1
+                    elif roll < 0.15:
+                        system.reservations.reserve(lines, ttl=0.0)
+                        counts['abandoned'] += 1
+                    else:
+                        invoice = system.create_invoice(f"INV{seed}-{i}", "C1", lines,
+                                                        InvoiceStatus.PAID)
+                        for item in invoice.items:
+                            sold[seed][item.product_id] += item.quantity
+                        counts['orders'] += 1
+                except ValueError:
+                    counts['rejected'] += 1
+
+        start = time.perf_counter()
+        errors = _run_threads([lambda seed=seed: shopper(seed) for seed in range(workers)])
+        elapsed = time.perf_counter() - start
+        if errors:
+            raise errors[0]
+        system.reservations.expire()
+
+        oversold = 0
+        for product_id, stock in hot.items():
+            units = sum(counts[product_id] for counts in sold)
+            oversold += max(0, units - stock)
+            if system.products[product_id].quantity != stock - units:
+                raise AssertionError(f"Stock for {product_id} does not match units sold")
+        if system.reservations.held or len(system.reservations):
+            raise AssertionError("Reservations left holding stock")
+        if oversold:
+            raise AssertionError(f"Oversold {oversold} units")
+        system.close()
+    finally:
+        sys.setswitchinterval(switch_interval)
+        shutil.rmtree(directory, ignore_errors=True)
+    attempts = per_worker * workers
+    return {
+        'orders': sum(counts['orders'] for counts in outcomes),
+        'rejected': sum(counts['rejected'] for counts in outcomes),
+        'abandoned': sum(counts['abandoned'] for counts in outcomes),
+        'oversold_units': oversold,
+        'attempts_per_sec': attempts / elapsed
+    }
+
+def bench_import(count: int = 100000) -> Dict[str, float]:
+    # Batched feed import against adding the same products one at a time;
+    # every 100th row is invalid and must be rejected
+    category = next(iter(ProductCategory))
+    directory = tempfile.mkdtemp()
+    try:
+        feed = os.path.join(directory, "feed.csv")
+        with open(feed, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['id', 'name', 'price', 'quantity', 'category', 'reorder_level'])
+            for i in range(count):
+                price = "n/a" if i % 100 == 99 else f"{1 + i % 500}.99"
+                writer.writerow([f"SKU{i}", f"Product {i}", price, i % 1000, category.value, 5])
+
+        system = InventorySystem(os.path.join(directory, "batched.json"))
+        stats = system.import_products(feed, rejects_path=os.path.join(directory, "rejects.csv"))
+        system.close()
+        if stats['rejected'] != count // 100:
+            raise AssertionError(f"Expected {count // 100} rejected rows, got {stats['rejected']}")
+        reloaded = InventorySystem(os.path.join(directory, "batched.json"))
+        if len(reloaded.products) != stats['imported']:
+            raise AssertionError("Imported products were not all persisted")
+        reloaded.close()
+
+        system = InventorySystem(os.path.join(directory, "single.json"))
+        start = time.perf_counter()
+        for _, row in _iter_feed_rows(feed):
+            try:
+                system.add_product(_product_from_row(row))
+            except ValueError:
+                pass
+        single = time.perf_counter() - start
+        system.close()
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    return {
+        'imported': stats['imported'],
+        'rejected': stats['rejected'],
+        'batched_rows_per_sec': stats['rows_per_sec'],
+        'single_rows_per_sec': count / single,
+        'speedup': single / stats['seconds']
+    }
+
+def bench_metrics(count: int = 1000000) -> Dict[str, float]:
+    # Per-call cost of an instrumented function with collection off and on,
+    # next to the same function undecorated
+    def plain(x):
+        return x
+
+    decorated = instrumented('bench')(plain)
+    enabled = METRICS.enabled
+    results = {}
+    try:
+        for name, func, collect in (('plain_ns', plain, False),
+                                    ('disabled_ns', decorated, False),
+                                    ('enabled_ns', decorated, True)):
+            METRICS.enabled = collect
+            start = time.perf_counter()
+            for i in range(count):
+                func(i)
+            results[name] = (time.perf_counter() - start) / count * 1e9
+    finally:
+        METRICS.enabled = enabled
+        METRICS._timers.pop(('operation_seconds', (('operation', 'bench'),)), None)
+    results['disabled_overhead_ns'] = results['disabled_ns'] - results['plain_ns']
+    return results
+
+def bench_low_stock(count: int = 100000) -> Dict[str, float]:
+    # Watchlist query against a catalog scan, with the list kept current
+    # through random stock and reorder level changes
+    category = next(iter(ProductCategory))
+    rng = random.Random(0)
+    directory = tempfile.mkdtemp()
+    try:
+        system = InventorySystem(os.path.join(directory, "bench.json"))
+        system.add_products(Product(f"P{i}", f"Product {i}", 1.0, rng.randint(0, 1000), category,
+                                    rng.randint(0, 20)) for i in range(count))
+        product_ids = list(system.products)
+        start = time.perf_counter()
+        for _ in range(10000):
+            product = system.products[rng.choice(product_ids)]
+            if rng.random() < 0.5:
+                product.quantity = rng.randint(0, 1000)
+            else:
+                product.reorder_level = rng.randint(0, 50)
+        update = (time.perf_counter() - start) / 10000
+
+        start = time.perf_counter()
+        scanned = sorted((p for p in system.products.values() if p.quantity <= p.reorder_level),
+                         key=LowStockWatchlist._urgency)
+        scan = time.perf_counter() - start
+        start = time.perf_counter()
+        watched = system.low_stock_products()
+        query = time.perf_counter() - start
+        start = time.perf_counter()
+        system.low_stock_products(10)
+        top = time.perf_counter() - start
+        if [p.id for p in watched] != [p.id for p in scanned]:
+            raise AssertionError("Watchlist differs from a catalog scan")
+        system.close()
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    return {
+        'low_stock_products': len(watched),
+        'scan_ms': scan * 1000,
+        'watchlist_ms': query * 1000,
+        'top10_us': top * 1e6,
+        'update_us': update * 1e6
+    }
+
+_BENCHMARKS = {
+    'memory': bench_memory,
+    'pricing': bench_pricing,
+    'permissions': bench_permissions,
+    'concurrency': bench_concurrency,
+    'reservations': bench_reservations,
+    'import': bench_import,
+    'metrics': bench_metrics,
+    'lowstock': bench_low_stock
+}
+
+# Benchmark suite: a deterministic synthetic dataset at a named scale (the
+# number of invoices) and wall-clock timings for loading, saving, pricing,
+# every report and every export, written as JSON for run-to-run comparison
+_SCALES = {'1k': 1000, '100k': 100000, '10m': 10000000}
+# Above this many invoices the suite never holds the invoice history in
+# memory (see run_benchmark_suite)
+_IN_MEMORY_INVOICES = 100000
+
+def _synthetic_records(invoices: int, seed: int) -> Dict[str, Iterator[Tuple[str, dict]]]:
+    # Each collection has its own seeded stream, so every collection is
+    # reproducible on its own and the whole dataset never sits in memory
+    product_count = max(100, invoices // 20)
+    customer_count = max(50, invoices // 100)
+    categories = list(ProductCategory)
+    statuses = list(InvoiceStatus)
+    roles = [Role.ADMIN, Role.MANAGER, Role.STAFF]
+    base_date = datetime.date(2023, 1, 1)
+
+    def products():
+        rng = random.Random(f"{seed}:products")
+        for i in range(product_count):
+            rules = []
+            if rng.random() < 0.3:
+                rules.append(PercentageDiscount(rng.choice((5, 10, 15))))
+            if rng.random() < 0.3:
+                rules.append(BulkDiscount(rng.choice((10, 25, 50)), rng.choice((5, 10, 20))))
+            product = Product(f"P{i:07d}", f"Product {i}", round(rng.uniform(1, 500), 2),
+                              rng.randint(0, 1000), rng.choice(categories),
+                              rng.randint(5, 50), rules or None)
+            yield product.id, _product_to_record(product)
+
+    def customers():
+        for i in range(customer_count):
+            customer = Customer(f"C{i:07d}", f"Customer {i}", f"customer{i}@example.com",
+                                f"555-{i % 10000:04d}", f"{i} Benchmark Street")
+            yield customer.id, _customer_to_record(customer)
+
+    def users():
+        for i in range(10):
+            user = User(f"user{i}", f"password{i}", roles[i % len(roles)])
+            yield user.username, _user_to_record(user)
+
+    def invoice_records():
+        rng = random.Random(f"{seed}:invoices")
+        for i in range(invoices):
+            items = [InvoiceItem(f"P{rng.randrange(product_count):07d}", rng.randint(1, 10),
+                                 round(rng.uniform(1, 500), 2))
+                     for _ in range(rng.randint(1, 5))]
+            status = InvoiceStatus.PAID if rng.random() < 0.7 else rng.choice(statuses)
+            date = base_date + datetime.timedelta(days=rng.randrange(730))
+            invoice = Invoice(f"INV{i:08d}", f"C{rng.randrange(customer_count):07d}",
+                              date.isoformat(), status, items, rng.choice((0.0, 0.05, 0.1)))
+            yield invoice.id, _invoice_to_record(invoice)
+
+    return {'products': products(), 'customers': customers(),
+            'users': users(), 'invoices': invoice_records()}
+
+def generate_dataset(path: str, invoices: int, seed: int = 0) -> Dict[str, int]:
+    # Streams the dataset straight into a data file in the format
+    # open_storage expects for that path; returns record counts
+    counts = {}
+    collections = _synthetic_records(invoices, seed)
+    storage = open_storage(path)
+    if isinstance(storage, SqliteStorage):
+        for collection, records in collections.items():
+            counts[collection] = 0
+            while True:
+                batch = list(itertools.islice(records, 10000))
+                if not batch:
+                    break
+                storage.put_many(collection, batch)
+                counts[collection] += len(batch)
+        storage.close()
+        return counts
+
+    storage.close()
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write('{')
+        for position, (collection, records) in enumerate(collections.items()):
+            f.write(f"{', ' if position else ''}{json.dumps(collection)}: {{")
+            counts[collection] = 0
+            for key, record in records:
+                f.write(f"{', ' if counts[collection] else ''}{json.dumps(key)}: "
+                        f"{json.dumps(record, default=str)}")
+                counts[collection] += 1
+            f.write('}')
+        f.write('}')
+    os.replace(tmp_path, path)
+    return counts
+
+def run_benchmark_suite(scale: str = '1k', seed: int = 0, storage: str = 'json',
+                        progress: Optional[Callable[[str, float], None]] = None,
+                        repeat: int = 3) -> dict:
+    if scale not in _SCALES:
+        raise ValueError(f"Unknown scale: {scale}")
+    if storage not in ('json', 'sqlite'):
+        raise ValueError(f"Unknown storage: {storage}")
+    timings: Dict[str, float] = {}
+
+    def timed(name: str, func: Callable, *args, runs: int = 1,
+              setup: Optional[Callable[[], None]] = None):
+        # Best of runs; only side-effect free steps are repeated, and setup
+        # (untimed) runs before each one
+        best = math.inf
+        for _ in range(runs):
+            if setup is not None:
+                setup()
+            start = time.perf_counter()
+            result = func(*args)
+            best = min(best, time.perf_counter() - start)
+        timings[name] = best
+        if progress is not None:
+            progress(name, best)
+        return result
+
+    directory = tempfile.mkdtemp()
+    cwd = os.getcwd()
+    try:
+        path = os.path.join(directory, 'bench.db' if storage == 'sqlite' else 'bench.json')
+        counts = timed('generate', generate_dataset, path, _SCALES[scale], seed)
+        system = timed('load', InventorySystem, path)
+        # Large scales never materialize every invoice: steps that would are
+        # skipped, and the invoices are timed as a streaming decode instead.
+        # SQLite answers aggregates and invoice lookups with queries, so it
+        # keeps more of the suite than JSON does.
+        in_memory = _SCALES[scale] <= _IN_MEMORY_INVOICES
+        indexed = storage == 'sqlite'
+        timed('stream_invoices',
+              lambda: deque(system.storage.load_collection('invoices'), maxlen=0))
+        if in_memory:
+            timed('load_invoices', len, system.invoices)
+        if in_memory or indexed:
+            timed('build_sales_aggregates', system._rebuild_sales_aggregates)
+        if in_memory:
+            timed('build_invoice_indexes', system._ensure_invoice_indexes)
+            timed('save', system.save_data)
+
+        rng = random.Random(f"{seed}:workload")
+        product_ids = list(system.products)
+        lines = [(rng.choice(product_ids), rng.randint(1, 60)) for _ in range(100000)]
+        products = system.products
+        timed('pricing_get_price', lambda: [products[product_id].get_price(quantity)
+                                            for product_id, quantity in lines], runs=repeat)
+        # Cold runs start from an empty price cache and measure pricing;
+        # warm runs follow on the filled cache and measure the cache
+        quote_all = lambda: [system.quote(product_id, quantity) for product_id, quantity in lines]
+        timed('pricing_quote_cold', quote_all, runs=repeat, setup=system.price_cache.clear)
+        timed('pricing_quote_warm', quote_all, runs=repeat)
+        timed('pricing_quote_many', system.quote_many,
+              [product_id for product_id, _ in lines], [quantity for _, quantity in lines],
+              runs=repeat)
+
+        # The sales report walks every invoice in range; the two below it
+        # read the sales aggregates
+        reports = [name for name in InventorySystem._REPORTS
+                   if in_memory or name == 'inventory'
+                   or (indexed and name in ('product_performance', 'customer_analysis'))]
+        for name in reports:
+            timed(f"report_{name}", lambda: deque(system.iter_report(name), maxlen=0),
+                  runs=repeat)
+
+        # Inventory exports write to fixed names in the working directory
+        os.chdir(directory)
+        timed('export_inventory_csv', system.export_inventory_report, 'csv')
+        timed('export_inventory_csv_gz', system.export_inventory_report, 'csv', True)
+        timed('export_inventory_pdf', system.export_inventory_report, 'pdf')
+        # PDF-per-record exports use a fixed sample so scales stay comparable.
+        # Invoice ids follow _synthetic_records, so sampling them needs no
+        # scan of the invoices.
+        if in_memory or indexed:
+            invoice_ids = [f"INV{i:08d}" for i in
+                           rng.sample(range(counts['invoices']), min(200, counts['invoices']))]
+            customer_ids = rng.sample(sorted(system.customers), min(100, len(system.customers)))
+            timed('export_invoice_pdfs', system.export_invoice_pdfs,
+                  os.path.join(directory, 'invoices'), invoice_ids)
+            timed('export_customer_statements', system.export_customer_statements,
+                  os.path.join(directory, 'statements'), None, None, customer_ids)
+        system.close()
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(directory, ignore_errors=True)
+    return {
+        'scale': scale,
+        'seed': seed,
+        'storage': storage,
+        'counts': counts,
+        'seconds': timings,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'numpy': np is not None,
+        'created': datetime.datetime.now().isoformat(timespec='seconds')
+    }
+
+def compare_benchmark_results(baseline: dict, current: dict, tolerance: float = 0.1,
+                              min_seconds: float = 0.001) -> Iterator[str]:
+    # One line per timing; changes beyond tolerance are flagged unless both
+    # runs were too quick (under min_seconds) for the difference to mean much.
+    # Runs are only comparable on the same dataset and interpreter, so any
+    # difference there is warned about first.
+    for setting in ('scale', 'seed', 'storage', 'counts', 'python', 'numpy'):
+        if baseline.get(setting) != current.get(setting):
+            yield (f"warning: {setting} differs "
+                   f"({baseline.get(setting)} vs {current.get(setting)})")
+    for name, seconds in current['seconds'].items():
+        before = baseline['seconds'].get(name)
+        if before is None:
+            yield f"{name}: {seconds:.4f}s (new)"
+            continue
+        ratio = seconds / before if before else math.inf
+        flag = ""
+        if max(seconds, before) >= min_seconds:
+            flag = (" REGRESSION" if ratio > 1 + tolerance
+                    else " improved" if ratio < 1 - tolerance else "")
+        yield f"{name}: {before:.4f}s -> {seconds:.4f}s ({ratio:.2f}x){flag}"
+    for name in sorted(baseline['seconds'].keys() - current['seconds'].keys()):
+        yield f"{name}: {baseline['seconds'][name]:.4f}s (not run)"
+
+def main(data_file: str = "inventory_data.json"):
+    system = InventorySystem(data_file)
     current_user = None
     
     while True:
@@ -231,7 +3929,41 @@ def main():
         
         choice = input("Enter your choice (1-7): ")
         
-        if choice == "4" and system.check_permission(current_user, "view_reports"):
+        if choice == "3" and system.check_permission(current_user, "read"):
+            print("\nInvoice Management")
+            print("1. Invoices for Customer")
+            print("2. Invoices by Status")
+            print("3. Invoices Containing Product")
+            print("4. Change Invoice Status")
+            subchoice = input("Enter your choice (1-4): ")
+
+            if subchoice == "1":
+                customer_id = input("Customer ID: ")
+                for invoice in system.invoices_for_customer(customer_id):
+                    print(f"{invoice.id}  {invoice.date}  {invoice.status.value}  ${invoice.total:.2f}")
+            elif subchoice == "2":
+                status = input(f"Status ({', '.join(s.value for s in InvoiceStatus)}): ")
+                try:
+                    invoices = system.invoices_with_status(InvoiceStatus(status))
+                except ValueError:
+                    print("Invalid status!")
+                    continue
+                for invoice in invoices:
+                    print(f"{invoice.id}  {invoice.date}  {invoice.customer_id}  ${invoice.total:.2f}")
+            elif subchoice == "3":
+                product_id = input("Product ID: ")
+                for invoice, item in system.invoice_items_for_product(product_id):
+                    print(f"{invoice.id}  {invoice.date}  qty {item.quantity}  ${item.total:.2f}")
+            elif subchoice == "4" and system.check_permission(current_user, "write"):
+                invoice_id = input("Invoice ID: ")
+                status = input(f"New Status ({', '.join(s.value for s in InvoiceStatus)}): ")
+                try:
+                    system.set_invoice_status(invoice_id, InvoiceStatus(status))
+                    print("Invoice updated successfully!")
+                except (KeyError, ValueError):
+                    print("Invalid invoice or status!")
+
+        elif choice == "4" and system.check_permission(current_user, "view_reports"):
             print("\nReports")
             print("1. Inventory Report")
             print("2. Sales Report")
@@ -240,15 +3972,19 @@ def main():
             subchoice = input("Enter your choice (1-4): ")
             
             if subchoice == "1":
-                print(system.generate_inventory_report())
+                system.write_report('inventory', sys.stdout)
             elif subchoice == "2":
-                start_date = input("Start Date (YYYY-MM-DD): ")
-                end_date = input("End Date (YYYY-MM-DD): ")
-                print(system.generate_sales_report(start_date, end_date))
+                start_date = input("Start Date (YYYY-MM-DD, blank for open): ")
+                end_date = input("End Date (YYYY-MM-DD, blank for open): ")
+                period = input("Group by (month/quarter, blank for none): ")
+                try:
+                    system.write_report('sales', sys.stdout, start_date, end_date, period or None)
+                except ValueError as e:
+                    print(e)
             elif subchoice == "3":
-                print(system.generate_product_performance_report())
+                system.write_report('product_performance', sys.stdout)
             elif subchoice == "4":
-                print(system.generate_customer_analysis_report())
+                system.write_report('customer_analysis', sys.stdout)
 
         elif choice == "5" and system.check_permission(current_user, "view_reports"):
             print("\nExport Data")
@@ -266,7 +4002,170 @@ def main():
             current_user = None
             
         elif choice == "7":
+            system.close()
             break
 
+def cli(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Inventory and Invoice Management System")
+    parser.add_argument('--data', default="inventory_data.json",
+                        help="data file (.db/.sqlite selects the SQLite backend)")
+    parser.add_argument('--metrics-file',
+                        help="collect metrics and write them here (Prometheus text) on exit")
+    commands = parser.add_subparsers(dest='command')
+
+    migrate = commands.add_parser('migrate', help="copy all data between storage backends")
+    migrate.add_argument('source')
+    migrate.add_argument('target')
+
+    bench = commands.add_parser('bench', help="run a micro-benchmark or the benchmark suite")
+    bench.add_argument('name', choices=sorted([*_BENCHMARKS, 'suite']))
+    bench.add_argument('--count', type=int, default=100000)
+    bench.add_argument('--scale', choices=list(_SCALES), default='1k',
+                       help="suite only; 10m never holds all invoices in memory, so steps "
+                            "that would are skipped (fewer with --storage sqlite)")
+    bench.add_argument('--seed', type=int, default=0, help="suite only")
+    bench.add_argument('--storage', choices=('json', 'sqlite'), default='json', help="suite only")
+    bench.add_argument('--output', help="suite only: write results as JSON")
+    bench.add_argument('--compare', help="suite only: earlier results JSON to compare against")
+
+    import_products = commands.add_parser('import-products',
+                                          help="bulk import products from a CSV or JSONL feed")
+    import_products.add_argument('feed', help="CSV or JSONL file, optionally .gz")
+    import_products.add_argument('--format', choices=('csv', 'jsonl'),
+                                 help="default: from the file extension")
+    import_products.add_argument('--batch-size', type=int, default=5000)
+    import_products.add_argument('--rejects', help="write rejected rows to this CSV file")
+
+    ingest = commands.add_parser('ingest-invoices',
+                                 help="bulk load invoices from a JSONL file, resumably")
+    ingest.add_argument('source', help="JSONL file, one invoice per line")
+    ingest.add_argument('--workers', type=int, help="parser processes (default: CPU count)")
+    ingest.add_argument('--chunk-size', type=int, default=2000)
+    ingest.add_argument('--checkpoint', help="default: SOURCE.checkpoint")
+    ingest.add_argument('--rejects', help="write rejected rows to this CSV file")
+    ingest.add_argument('--no-stock', action='store_true',
+                        help="do not deduct stock (e.g. for historical sales)")
+
+    low_stock = commands.add_parser('low-stock',
+                                    help="list products at or below their reorder level")
+    low_stock.add_argument('--limit', type=int, help="show only the most urgent N")
+
+    serve = commands.add_parser('serve', help="run the HTTP/JSON API server")
+    serve.add_argument('--host', default='127.0.0.1')
+    serve.add_argument('--port', type=int, default=8080)
+    serve.add_argument('--workers', type=int, default=4,
+                       help="threads for reports and exports")
+    serve.add_argument('--export-root',
+                       help="directory POST /exports may write below (exports are off without it)")
+    serve.add_argument('--metrics', action='store_true',
+                       help="collect metrics and serve them at GET /metrics")
+
+    report = commands.add_parser('report', help="stream a report to stdout or a file")
+    report.add_argument('name', choices=sorted(InventorySystem._REPORTS))
+    report.add_argument('--output', help="file to write instead of stdout")
+    report.add_argument('--start-date')
+    report.add_argument('--end-date')
+    report.add_argument('--period', choices=['month', 'quarter'])
+
+    export_pdfs = commands.add_parser('export-pdfs',
+                                      help="render invoice or customer statement PDFs in parallel")
+    export_pdfs.add_argument('kind', choices=['invoices', 'statements'])
+    export_pdfs.add_argument('output_dir')
+    export_pdfs.add_argument('--workers', type=int)
+    export_pdfs.add_argument('--start-date')
+    export_pdfs.add_argument('--end-date')
+
+    args = parser.parse_args(argv)
+    if args.metrics_file:
+        METRICS.enabled = True
+        atexit.register(METRICS.write, args.metrics_file)
+    if args.command == 'migrate':
+        migrate_storage(open_storage(args.source), open_storage(args.target))
+        print(f"Migrated {args.source} -> {args.target}")
+    elif args.command == 'bench' and args.name == 'suite':
+        results = run_benchmark_suite(args.scale, args.seed, args.storage,
+                                      lambda name, seconds: print(f"{name}: {seconds:.4f}s"))
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(results, f, indent=2)
+        if args.compare:
+            with open(args.compare) as f:
+                baseline = json.load(f)
+            print(f"\nCompared with {args.compare}:")
+            for line in compare_benchmark_results(baseline, results):
+                print(line)
+    elif args.command == 'bench':
+        for metric, value in _BENCHMARKS[args.name](args.count).items():
+            print(f"{metric}: {value:.1f}")
+    elif args.command == 'import-products':
+        system = InventorySystem(args.data)
+        try:
+            stats = system.import_products(args.feed, args.format, args.batch_size, args.rejects)
+        finally:
+            system.close()
+        print(f"Imported {stats['imported']} products, rejected {stats['rejected']} rows "
+              f"in {stats['seconds']:.2f}s ({stats['rows_per_sec']:.0f} rows/sec)")
+        if stats['rejected'] and args.rejects:
+            print(f"Rejected rows written to {args.rejects}")
+    elif args.command == 'ingest-invoices':
+        system = InventorySystem(args.data)
+        try:
+            stats = system.ingest_invoices(args.source, args.workers, args.chunk_size,
+                                           args.checkpoint, args.rejects, not args.no_stock)
+        finally:
+            system.close()
+        print(f"Ingested {stats['ingested']} invoices, rejected {stats['rejected']}, "
+              f"skipped {stats['skipped']} already present in {stats['seconds']:.2f}s "
+              f"({stats['invoices_per_sec']:.0f} invoices/sec)")
+    elif args.command == 'low-stock':
+        system = InventorySystem(args.data)
+        products = system.low_stock_products(args.limit)
+        system.close()
+        print(f"{len(system.low_stock)} products at or below reorder level")
+        for product in products:
+            print(f"{product.id}  {product.name}  Qty: {product.quantity}  "
+                  f"Reorder level: {product.reorder_level}")
+    elif args.command == 'serve':
+        if args.metrics:
+            METRICS.enabled = True
+        system = InventorySystem(args.data)
+        server = ApiServer(system, args.host, args.port, args.workers, args.export_root)
+        print(f"Serving on http://{args.host}:{args.port}")
+        try:
+            asyncio.run(server.serve_forever())
+        except KeyboardInterrupt:
+            pass
+        finally:
+            system.close()
+    elif args.command == 'report':
+        system = InventorySystem(args.data)
+        report_args = (args.start_date, args.end_date, args.period) if args.name == 'sales' else ()
+        if args.output:
+            with open(args.output, 'w', buffering=1 << 16) as f:
+                system.write_report(args.name, f, *report_args)
+        else:
+            system.write_report(args.name, sys.stdout, *report_args)
+        system.close()
+    elif args.command == 'export-pdfs':
+        system = InventorySystem(args.data)
+
+        def progress(done: int, path: str, error: Optional[str]):
+            if error is not None:
+                print(f"FAILED {path}: {error}")
+            elif done % 100 == 0:
+                print(f"{done} documents rendered")
+
+        if args.kind == 'invoices':
+            written, failures = system.export_invoice_pdfs(
+                args.output_dir, workers=args.workers, progress=progress)
+        else:
+            written, failures = system.export_customer_statements(
+                args.output_dir, args.start_date, args.end_date,
+                workers=args.workers, progress=progress)
+        system.close()
+        print(f"{len(written)} PDFs written to {args.output_dir}, {len(failures)} failed")
+    else:
+        main(args.data)
+
 if __name__ == "__main__":
-    main()
+    cli()